@@ -0,0 +1,244 @@
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import Counter
+from io import BytesIO
+
+from aiohttp import WSMsgType, web
+from PIL import Image
+
+
+class MockMoonraker:
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.offline = False
+        self.requests = Counter()
+        self.klippy_state = 'ready'
+        self.print_state = 'standby'
+        self.filename = ''
+        self.error_message = ''
+        self.estimated_time = 0
+        self.started_at = None
+        self.paused_progress = None
+        self.files = {}
+        self.snapshot = self._render_snapshot()
+        self.websockets = set()
+        self._runner = None
+        self._app = web.Application(
+            middlewares=[self._middleware], client_max_size=1 << 32)
+        self._app.router.add_get('/printer/info', self.printer_info)
+        self._app.router.add_get('/printer/objects/query', self.objects_query)
+        self._app.router.add_get('/machine/proc_stats', self.proc_stats)
+        self._app.router.add_get('/server/files/metadata', self.metadata)
+        self._app.router.add_get('/webcam/', self.webcam)
+        self._app.router.add_post('/server/files/upload', self.upload)
+        self._app.router.add_post('/printer/print/start', self.print_start)
+        self._app.router.add_get('/websocket', self.websocket)
+
+    async def start(self, host='127.0.0.1', port=0):
+        self._runner = web.AppRunner(self._app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        return f'http://{host}:{port}'
+
+    async def stop(self):
+        for websocket in list(self.websockets):
+            await websocket.close()
+        await self._runner.cleanup()
+
+    async def start_print(self, filename='benchy.gcode', estimated_time=3600):
+        self.print_state = 'printing'
+        self.filename = filename
+        self.error_message = ''
+        self.estimated_time = estimated_time
+        self.started_at = time.monotonic()
+        self.paused_progress = None
+        await self._broadcast()
+
+    async def pause(self):
+        self.paused_progress = self.progress()
+        self.print_state = 'paused'
+        await self._broadcast()
+
+    async def resume(self):
+        self.started_at = (time.monotonic()
+                           - self.paused_progress * self.estimated_time)
+        self.paused_progress = None
+        self.print_state = 'printing'
+        await self._broadcast()
+
+    async def complete(self):
+        self.print_state = 'complete'
+        await self._broadcast()
+
+    async def fail(self, message='Thermal runaway'):
+        self.print_state = 'error'
+        self.error_message = message
+        await self._broadcast()
+
+    def progress(self):
+        if self.paused_progress is not None:
+            return self.paused_progress
+        if self.print_state != 'printing' or not self.estimated_time:
+            return 1.0 if self.print_state == 'complete' else 0.0
+        return min(
+            (time.monotonic() - self.started_at) / self.estimated_time, 1.0)
+
+    def status(self):
+        return {
+            'webhooks': {'state': self.klippy_state, 'message': ''},
+            'print_stats': {
+                'state': self.print_state,
+                'filename': self.filename,
+                'message': self.error_message,
+                'info': {'current_layer': int(self.progress() * 250),
+                         'total_layer': 250},
+            },
+            'virtual_sdcard': {'progress': self.progress()},
+            'extruder': {'temperature': 214.7 + random.random(),
+                         'target': 215.0, 'power': 0.42},
+            'heater_bed': {'temperature': 59.8 + random.random(),
+                           'target': 60.0, 'power': 0.31},
+            'heater_generic heater_bed_outer': {
+                'temperature': 45.1, 'target': 45.0, 'power': 0.12},
+        }
+
+    @web.middleware
+    async def _middleware(self, request, handler):
+        self.requests[request.path] += 1
+        delay = self.latency + random.uniform(0, self.jitter)
+        if delay:
+            await asyncio.sleep(delay)
+        if self.offline or random.random() < self.error_rate:
+            return web.Response(status=530, text='origin is unreachable')
+        return await handler(request)
+
+    async def printer_info(self, request):
+        return web.json_response({'result': {'state': self.klippy_state}})
+
+    async def objects_query(self, request):
+        status = self.status()
+        result = {}
+        for name, fields in request.query.items():
+            values = status.get(name, {})
+            if fields:
+                values = {key: values[key] for key in fields.split(',')
+                          if key in values}
+            result[name] = values
+        return web.json_response(
+            {'result': {'eventtime': time.monotonic(), 'status': result}})
+
+    async def proc_stats(self, request):
+        return web.json_response({'result': {
+            'system_cpu_usage': {'cpu': 12.5 + random.random() * 10},
+            'cpu_temp': 48.3,
+            'throttled_state': {'bits': 0, 'flags': []},
+            'system_memory': {'total': 1024000, 'used': 412000},
+        }})
+
+    async def metadata(self, request):
+        return web.json_response({'result': {
+            'filename': request.query.get('filename'),
+            'estimated_time': self.estimated_time,
+            'modified': 1700000000.0,
+        }})
+
+    async def webcam(self, request):
+        return web.Response(body=self.snapshot, content_type='image/jpeg')
+
+    async def upload(self, request):
+        root, filename, size = 'gcodes', None, 0
+        async for part in await request.multipart():
+            if part.name == 'root':
+                root = await part.text()
+            elif part.name == 'file':
+                filename = part.filename
+                while chunk := await part.read_chunk():
+                    size += len(chunk)
+        if not filename:
+            return web.json_response(
+                {'error': {'message': 'No file'}}, status=400)
+        action = 'modify_file' if filename in self.files else 'create_file'
+        self.files[filename] = size
+        return web.json_response({'result': {
+            'item': {'path': filename, 'root': root, 'size': size},
+            'print_started': False,
+            'action': action,
+        }})
+
+    async def print_start(self, request):
+        filename = request.query.get('filename')
+        if filename not in self.files:
+            return web.json_response(
+                {'error': {'message': f'File {filename} not found'}},
+                status=400)
+        await self.start_print(filename, self.estimated_time or 3600)
+        return web.json_response({'result': 'ok'})
+
+    async def websocket(self, request):
+        websocket = web.WebSocketResponse()
+        await websocket.prepare(request)
+        self.websockets.add(websocket)
+        try:
+            async for message in websocket:
+                if message.type != WSMsgType.TEXT:
+                    break
+                data = json.loads(message.data)
+                if data.get('method') == 'printer.objects.subscribe':
+                    objects = data['params']['objects']
+                    status = {name: self.status().get(name, {})
+                              for name in objects}
+                    await websocket.send_json({
+                        'jsonrpc': '2.0',
+                        'id': data['id'],
+                        'result': {'eventtime': time.monotonic(),
+                                   'status': status},
+                    })
+        finally:
+            self.websockets.discard(websocket)
+        return websocket
+
+    async def _broadcast(self):
+        status = self.status()
+        update = {
+            'print_stats': status['print_stats'],
+            'virtual_sdcard': status['virtual_sdcard'],
+        }
+        for websocket in list(self.websockets):
+            await websocket.send_json({
+                'jsonrpc': '2.0',
+                'method': 'notify_status_update',
+                'params': [update, time.monotonic()],
+            })
+
+    def _render_snapshot(self):
+        output = BytesIO()
+        Image.effect_noise((1280, 720), 40).convert('RGB').save(
+            output, format='JPEG', quality=80)
+        return output.getvalue()
+
+
+async def serve(args):
+    moonraker = MockMoonraker(args.latency, args.jitter, args.error_rate)
+    url = await moonraker.start(args.host, args.port)
+    await moonraker.start_print(estimated_time=args.print_time)
+    print(f'Mock Moonraker listening on {url}')
+    await asyncio.Event().wait()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Local stand-in for the Moonraker API.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=7125)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--jitter', type=float, default=0.02)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--print-time', type=int, default=3600)
+    asyncio.run(serve(parser.parse_args()))
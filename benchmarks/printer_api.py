@@ -0,0 +1,133 @@
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from mock_moonraker import MockMoonraker  # noqa: E402
+from printer import PrinterAPI  # noqa: E402
+
+
+HANDLERS = (
+    'printer_info', 'proc_stats', 'print_status', 'temperatures',
+    'dashboard', 'photo',
+)
+
+
+def report(title, timings):
+    print(f'{title:>14}: median {statistics.median(timings):7.2f} ms, '
+          f'p95 {percentile(timings, 95):7.2f} ms, '
+          f'max {max(timings):7.2f} ms')
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    return values[min(len(values) - 1, len(values) * percent // 100)]
+
+
+def reset_caches(printer_api):
+    printer_api._cache.clear()
+    printer_api._metadata.clear()
+
+
+async def handler_latency(printer_api, rounds):
+    print('Per-handler latency, caches cleared before every call')
+    for name in HANDLERS:
+        timings = []
+        for _ in range(rounds):
+            reset_caches(printer_api)
+            started = time.perf_counter()
+            await getattr(printer_api, name)()
+            timings.append((time.perf_counter() - started) * 1000)
+        report(name, timings)
+
+
+async def throughput(printer_api, moonraker, concurrency, duration, think,
+                     cached):
+    mode = 'cache kept' if cached else 'cache cleared every call'
+    print(f'Concurrent print_status, {concurrency} callers for {duration}s, '
+          f'{think * 1000:.0f} ms think time, {mode}')
+    moonraker.requests.clear()
+    calls = [0] * concurrency
+    deadline = time.perf_counter() + duration
+
+    async def caller(number):
+        while time.perf_counter() < deadline:
+            if not cached:
+                reset_caches(printer_api)
+            await printer_api.print_status()
+            calls[number] += 1
+            await asyncio.sleep(think)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(caller(number) for number in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    upstream = sum(moonraker.requests.values())
+    print(f'{"replies":>14}: {sum(calls) / elapsed:9.1f} /s')
+    print(f'{"per caller":>14}: min {min(calls)}, '
+          f'median {statistics.median(calls):.0f}, max {max(calls)}')
+    print(f'{"upstream":>14}: {upstream / elapsed:9.1f} /s')
+
+
+async def monitor_cpu(printer_api, chats, duration, interval):
+    mode = 'websocket' if printer_api.subscribed else 'polling'
+    print(f'Print monitor, {chats} chats every {interval}s via {mode}')
+
+    async def monitor():
+        deadline = time.perf_counter() + duration
+        while time.perf_counter() < deadline:
+            state, _ = await printer_api.current_print_state()
+            if state == 'printing':
+                await printer_api.remaining_time()
+            await asyncio.sleep(interval)
+
+    cpu_started = time.process_time()
+    started = time.perf_counter()
+    await asyncio.gather(*(monitor() for _ in range(chats)))
+    cpu = time.process_time() - cpu_started
+    elapsed = time.perf_counter() - started
+    print(f'{"cpu":>14}: {cpu * 1000:9.1f} ms '
+          f'({cpu / elapsed * 100:.2f}% of one core)')
+
+
+async def main(args):
+    moonraker = MockMoonraker(args.latency, args.jitter)
+    os.environ['PRINTER_URL'] = await moonraker.start()
+    await moonraker.start_print(estimated_time=7200)
+    printer_api = PrinterAPI()
+    try:
+        await handler_latency(printer_api, args.rounds)
+        for cached in (True, False):
+            await throughput(
+                printer_api, moonraker, args.concurrency, args.duration,
+                args.think, cached)
+        await monitor_cpu(
+            printer_api, args.chats, args.duration, args.interval)
+        printer_api.start()
+        for _ in range(50):
+            if printer_api.subscribed:
+                break
+            await asyncio.sleep(0.1)
+        await monitor_cpu(
+            printer_api, args.chats, args.duration, args.interval)
+    finally:
+        await printer_api.close()
+        await moonraker.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Benchmark PrinterAPI against a mock Moonraker.')
+    parser.add_argument('--latency', type=float, default=0.03)
+    parser.add_argument('--jitter', type=float, default=0.01)
+    parser.add_argument('--rounds', type=int, default=20)
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--duration', type=float, default=5)
+    parser.add_argument('--think', type=float, default=0.01)
+    parser.add_argument('--chats', type=int, default=10)
+    parser.add_argument('--interval', type=float, default=0.5)
+    asyncio.run(main(parser.parse_args()))
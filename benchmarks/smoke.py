@@ -0,0 +1,126 @@
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from mock_moonraker import MockMoonraker  # noqa: E402
+from printer import PrinterAPI, PrinterError  # noqa: E402
+
+
+failures = []
+
+
+def check(condition, description):
+    print(f'{"ok" if condition else "FAIL":>4}  {description}')
+    if not condition:
+        failures.append(description)
+
+
+async def wait_for(predicate, timeout=3):
+    for _ in range(int(timeout / 0.05)):
+        if predicate():
+            return True
+        await asyncio.sleep(0.05)
+    return predicate()
+
+
+async def check_cache(printer_api, moonraker):
+    moonraker.requests.clear()
+    results = await asyncio.gather(
+        *(printer_api.print_status() for _ in range(20)))
+    check(moonraker.requests['/printer/objects/query'] == 1,
+          'concurrent print_status calls share one upstream query')
+    check(moonraker.requests['/server/files/metadata'] == 1,
+          'concurrent print_status calls share one metadata request')
+    check(len(set(results)) == 1 and results[0].startswith('Печатается'),
+          'coalesced callers get the same print status')
+    await printer_api.print_status()
+    check(moonraker.requests['/printer/objects/query'] == 1,
+          'repeated print_status within the TTL is served from cache')
+
+
+async def check_polling_state(printer_api):
+    state, message = await printer_api.current_print_state()
+    check((state, message) == ('printing', None),
+          'polling reports an active print')
+
+
+async def check_listener(printer_api, moonraker):
+    states = []
+
+    async def listener(state, message):
+        states.append(state)
+
+    printer_api.add_print_state_listener(listener)
+    printer_api.start()
+    check(await wait_for(lambda: printer_api.subscribed),
+          'websocket subscription is established')
+    await moonraker.pause()
+    check(await wait_for(lambda: states[-1:] == ['paused']),
+          'pause reaches the print state listener')
+    await moonraker.resume()
+    check(await wait_for(lambda: states[-1:] == ['printing']),
+          'resume reaches the print state listener')
+
+
+async def check_upload(printer_api, moonraker):
+    size = 3 * 1024 * 1024 + 17
+
+    async def chunks():
+        for offset in range(0, size, 65536):
+            yield b';' * min(65536, size - offset)
+
+    printer_api._metadata['smoke.gcode'] = 1
+    result = await printer_api.upload('smoke.gcode', chunks())
+    check('smoke.gcode' not in printer_api._metadata,
+          'upload drops cached metadata for the replaced file')
+    check(result['item']['path'] == 'smoke.gcode'
+          and moonraker.files.get('smoke.gcode') == size,
+          'upload streams the whole file to Moonraker')
+    await printer_api.start_print('smoke.gcode')
+    check(moonraker.print_state == 'printing'
+          and moonraker.filename == 'smoke.gcode',
+          'start_print starts the uploaded file')
+    try:
+        await printer_api.start_print('missing.gcode')
+        check(False, 'starting a missing file fails')
+    except PrinterError:
+        check(True, 'starting a missing file fails')
+
+
+async def check_offline(printer_api, moonraker):
+    moonraker.offline = True
+    moonraker.requests.clear()
+    try:
+        await printer_api.ping()
+        check(False, 'offline printer raises PrinterError')
+    except PrinterError as e:
+        check('530' in str(e), 'offline printer raises PrinterError')
+    check(moonraker.requests['/printer/info'] == 1,
+          'status 530 is not retried')
+    moonraker.offline = False
+
+
+async def main():
+    moonraker = MockMoonraker()
+    os.environ['PRINTER_URL'] = await moonraker.start()
+    await moonraker.start_print(estimated_time=7200)
+    printer_api = PrinterAPI()
+    try:
+        await check_cache(printer_api, moonraker)
+        await check_polling_state(printer_api)
+        await check_upload(printer_api, moonraker)
+        await check_offline(printer_api, moonraker)
+        await check_listener(printer_api, moonraker)
+    finally:
+        await printer_api.close()
+        await moonraker.stop()
+    if failures:
+        print(f'{len(failures)} check(s) failed')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
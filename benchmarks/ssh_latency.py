@@ -0,0 +1,82 @@
+import asyncio
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import asyncssh
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from home_server import HomeServer  # noqa: E402
+
+
+USERNAME = 'bench'
+PASSWORD = 'bench'
+COMMAND = 'true'
+ROUNDS = 20
+
+
+class BenchServer(asyncssh.SSHServer):
+    def begin_auth(self, username):
+        return True
+
+    def password_auth_supported(self):
+        return True
+
+    def validate_password(self, username, password):
+        return username == USERNAME and password == PASSWORD
+
+
+async def handle_process(process):
+    process.exit(0)
+
+
+async def measure(run):
+    timings = []
+    for _ in range(ROUNDS):
+        started = time.perf_counter()
+        await run()
+        timings.append((time.perf_counter() - started) * 1000)
+    return timings
+
+
+def report(title, timings):
+    print(f'{title:>5}: median {statistics.median(timings):7.2f} ms, '
+          f'min {min(timings):7.2f} ms, max {max(timings):7.2f} ms')
+
+
+async def main():
+    with tempfile.TemporaryDirectory() as directory:
+        host_key = Path(directory) / 'host_key'
+        asyncssh.generate_private_key('ssh-ed25519').write_private_key(
+            host_key)
+        server = await asyncssh.create_server(
+            BenchServer, '127.0.0.1', 0,
+            server_host_keys=[str(host_key)],
+            process_factory=handle_process)
+        port = server.sockets[0].getsockname()[1]
+
+        async def cold():
+            async with asyncssh.connect(
+                    '127.0.0.1', port=port, username=USERNAME,
+                    password=PASSWORD, known_hosts=None) as connection:
+                await connection.run(COMMAND, check=True)
+
+        home_server = HomeServer(
+            '127.0.0.1', USERNAME, PASSWORD, port=port)
+        await home_server.connect()
+
+        async def warm():
+            await home_server.run(COMMAND)
+
+        report('cold', await measure(cold))
+        report('warm', await measure(warm))
+        await home_server.close()
+        server.close()
+        await server.wait_closed()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
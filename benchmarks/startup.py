@@ -0,0 +1,55 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+
+ROOT = Path(__file__).resolve().parent.parent
+HEAVY_MODULES = ('asyncssh', 'PIL.Image', 'telegram.ext', 'aiohttp')
+PROBE = '''
+import sys, time
+started = time.perf_counter()
+import bot
+elapsed = time.perf_counter() - started
+loaded = [name for name in sys.argv[1:] if name in sys.modules]
+print(elapsed * 1000, ','.join(loaded))
+'''
+
+
+def import_bot(pycache_prefix):
+    env = dict(os.environ, PYTHONPYCACHEPREFIX=pycache_prefix)
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    output = subprocess.run(
+        [sys.executable, '-c', PROBE, *HEAVY_MODULES],
+        cwd=ROOT, env=env, check=True, capture_output=True, text=True,
+    ).stdout.split()
+    return float(output[0]), output[1] if len(output) > 1 else ''
+
+
+def report(title, timings):
+    print(f'{title:>14}: median {statistics.median(timings):7.1f} ms, '
+          f'max {max(timings):7.1f} ms')
+
+
+def main(args):
+    cold = []
+    for _ in range(args.rounds):
+        with tempfile.TemporaryDirectory() as pycache_prefix:
+            cold.append(import_bot(pycache_prefix)[0])
+    with tempfile.TemporaryDirectory() as pycache_prefix:
+        import_bot(pycache_prefix)
+        warm = [import_bot(pycache_prefix) for _ in range(args.rounds)]
+    print(f'Importing bot.py, {args.rounds} fresh interpreters each')
+    report('no bytecode', cold)
+    report('precompiled', [elapsed for elapsed, _ in warm])
+    print(f'{"heavy modules":>14}: {warm[-1][1] or "none"}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Measure how long the bot takes to import.')
+    parser.add_argument('--rounds', type=int, default=10)
+    main(parser.parse_args())
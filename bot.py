@@ -1,24 +1,71 @@
 import asyncio
 import logging
 import os
-
-import asyncssh
-from dotenv import load_dotenv
-from telegram import ReplyKeyboardMarkup, Update
-from telegram.ext import (Application, ApplicationBuilder, CommandHandler,
-                          ContextTypes, MessageHandler)
-from telegram.ext.filters import Chat, Regex, Text
-
-from printer import PrinterAPI
+import random
+from datetime import datetime, timezone
+from functools import partial
+
+from telegram import (InlineKeyboardButton, InlineKeyboardMarkup,
+                      ReplyKeyboardMarkup, Update)
+from telegram.error import BadRequest
+from telegram.ext import (Application, ApplicationBuilder,
+                          CallbackQueryHandler, CommandHandler, ContextTypes,
+                          MessageHandler)
+from telegram.ext.filters import Chat, Document, Regex, Text
+
+import config  # noqa: F401
+from events import EventEngine, create_rule
+from gcode_upload import GcodeUpload
+from history import HISTORY_CHART_MINUTES, HistorySampler
+from home_server import HomeServer
+from live_status import LiveStatus
+from metrics import (PRINT_MONITOR_LAG_SECONDS, InstrumentedRequest,
+                     start_server)
+from photo_feed import PhotoFeed
+from printer import PrinterAPI, user_error
+from printers import PrinterRegistry
+from state import MonitorStore
+from timelapse import TimelapseRecorder
+from webhook import WEBHOOK_URL, run_webhook
 
 
 PRINT_MONITOR_INTERVAL = 15
-PRINT_MONITOR_JOB_KEY = 'print_monitor_job'
-PRINT_MONITOR_LAST_STATE_KEY = 'print_monitor_last_state'
+PRINT_MONITOR_MIN_INTERVAL = 5
+PRINT_MONITOR_MAX_INTERVAL = 120
+PRINT_MONITOR_ETA_DIVISOR = 10
+PRINT_MONITOR_FAST_CHECKS = 4
+PRINT_MONITOR_MAX_FAILURES = 6
+PRINT_MONITORS_KEY = 'print_monitors'
+PRINT_MONITOR_JOB_KEY = 'job'
+PRINT_MONITOR_LAST_STATE_KEY = 'last_state'
+PRINT_MONITOR_PHASE_KEY = 'phase'
+PRINT_MONITOR_FAST_CHECKS_KEY = 'fast_checks'
+PRINT_MONITOR_FAILURES_KEY = 'failures'
+SELECTED_PRINTER_KEY = 'selected_printer'
+UPLOADED_FILES_KEY = 'uploaded_files'
+UPLOADED_FILES_LIMIT = 10
+START_PRINT_CALLBACK = 'start-print:'
+EVENT_RULES_USAGE = (
+    'Использование:\n'
+    '/notify layer <номер> — при достижении слоя\n'
+    '/notify progress <процент> — при достижении прогресса\n'
+    '/notify temp <градусы> — при отклонении температуры экструдера\n'
+    '/notify clear — удалить все уведомления'
+)
+LIVE_STATUS_ENABLED = os.getenv('LIVE_STATUS_ENABLED', '').lower() in (
+    '1', 'true')
+TIMELAPSE_KEY = 'timelapse'
+TIMELAPSE_ENABLED = os.getenv('TIMELAPSE_ENABLED', '').lower() in (
+    '1', 'true')
+TIMELAPSE_UPLOAD_TIMEOUT = 120
+TELEGRAM_API_SERVER = os.getenv('TELEGRAM_API_SERVER', '').rstrip('/')
+TELEGRAM_LOCAL_MODE = os.getenv('TELEGRAM_LOCAL_MODE', '').lower() in (
+    '1', 'true')
+TELEGRAM_DOWNLOAD_LIMIT = 20 * 1024 * 1024
+GCODE_GET_FILE_TIMEOUT = 300
 POWEROFF_COMMAND_DELAY_SECONDS = 15
 logging.getLogger('httpx').setLevel(logging.WARNING)
 logger = logging.getLogger(__name__)
-load_dotenv()
 
 
 def filter_chat_ids(app: Application) -> None:
@@ -34,6 +81,7 @@ def main_menu() -> ReplyKeyboardMarkup:
             ['Состояние принтера', 'Состояние оборудования'],
             ['Состояние печати', 'Температуры'],
             ['Режим печати', 'Фото'],
+            ['Сводка', 'Графики'],
             ['Включить', 'Выключить'],
         ],
         resize_keyboard=True,
@@ -42,240 +90,712 @@ def main_menu() -> ReplyKeyboardMarkup:
     )
 
 
+def selected_printer(context: ContextTypes.DEFAULT_TYPE) -> PrinterAPI:
+    return context.bot_data['printers'].get(
+        context.chat_data.get(SELECTED_PRINTER_KEY))
+
+
+def printer_text(application: Application, printer_api, text):
+    if application.bot_data['printers'].multiple:
+        return f'{printer_api.name}: {text}'
+    return text
+
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    logger.info(f'/start command from chat={update.effective_chat.id}')
+    logger.info('/start command from chat=%s', update.effective_chat.id)
     await update.message.reply_text(
         'Привет!', reply_markup=main_menu())
 
 
+async def select_printer(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    printers: PrinterRegistry = context.bot_data['printers']
+    if context.args:
+        name = context.args[0]
+        if name not in printers.printers:
+            await update.message.reply_text(f'Нет принтера {name}.')
+            return
+        logger.info('Printer %s selected chat=%s',
+                    name, update.effective_chat.id)
+        context.chat_data[SELECTED_PRINTER_KEY] = name
+    await update.message.reply_text(
+        f'Выбран принтер: {selected_printer(context).name}\n'
+        f'Доступные: {", ".join(printers.printers)}\n'
+        'Выбрать: /printer <имя>')
+
+
+async def farm_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    logger.info('Farm status requested chat=%s', update.effective_chat.id)
+    printers: PrinterRegistry = context.bot_data['printers']
+    message = await update.message.reply_text('Опрашиваю принтеры...')
+    results = await printers.fan_out(
+        lambda printer_api: printer_api.live_status())
+    await message.edit_text('\n\n'.join(
+        f'{name}\n{text}' for name, text in results.items()))
+
+
 async def printer_info(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    logger.info(
-        f'Printer status requested chat={update.effective_chat.id}')
-    printer_api: PrinterAPI = context.bot_data['printer_api']
+    logger.info('Printer status requested chat=%s', update.effective_chat.id)
+    printer_api = selected_printer(context)
     result = await printer_api.printer_info()
-    await update.message.reply_text(result)
+    await update.message.reply_text(
+        printer_text(context.application, printer_api, result))
 
 
 async def proc_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    logger.info(
-        f'Hardware status requested chat={update.effective_chat.id}')
-    printer_api: PrinterAPI = context.bot_data['printer_api']
+    logger.info('Hardware status requested chat=%s', update.effective_chat.id)
+    printer_api = selected_printer(context)
     result = await printer_api.proc_stats()
-    await update.message.reply_text(result)
+    await update.message.reply_text(
+        printer_text(context.application, printer_api, result))
 
 
 async def print_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    logger.info(
-        f'Print status requested chat={update.effective_chat.id}')
-    printer_api: PrinterAPI = context.bot_data['printer_api']
+    logger.info('Print status requested chat=%s', update.effective_chat.id)
+    printer_api = selected_printer(context)
     result = await printer_api.print_status()
-    await update.message.reply_text(result)
+    await update.message.reply_text(
+        printer_text(context.application, printer_api, result))
 
 
 async def temperatures(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    logger.info(
-        f'Temperatures requested chat={update.effective_chat.id}')
-    printer_api: PrinterAPI = context.bot_data['printer_api']
+    logger.info('Temperatures requested chat=%s', update.effective_chat.id)
+    printer_api = selected_printer(context)
     result = await printer_api.temperatures()
-    await update.message.reply_text(result)
+    await update.message.reply_text(
+        printer_text(context.application, printer_api, result))
+
+
+async def dashboard(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    logger.info('Dashboard requested chat=%s', update.effective_chat.id)
+    printer_api = selected_printer(context)
+    message = await update.message.reply_text('Собираю сводку...')
+    result = await printer_api.dashboard()
+    await message.edit_text(
+        printer_text(context.application, printer_api, result))
 
 
 async def photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    logger.info(f'Photo requested chat={update.effective_chat.id}')
-    printer_api: PrinterAPI = context.bot_data['printer_api']
+    logger.info('Photo requested chat=%s', update.effective_chat.id)
+    printer_api = selected_printer(context)
     try:
         photo = await printer_api.photo()
         await update.message.reply_photo(photo)
     except Exception:
         logger.exception(
-            f'Failed to fetch photo chat={update.effective_chat.id}')
+            'Failed to fetch photo chat=%s', update.effective_chat.id)
         await update.message.reply_text('Ошибка при получении фото')
 
 
+async def history_chart(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    logger.info('History chart requested chat=%s', update.effective_chat.id)
+    printer_api = selected_printer(context)
+    history: HistorySampler = context.bot_data['history'][printer_api.name]
+    try:
+        chart = await history.chart()
+    except Exception:
+        logger.exception(
+            'Failed to render chart chat=%s', update.effective_chat.id)
+        await update.message.reply_text('Ошибка при построении графика')
+        return
+    if chart is None:
+        await update.message.reply_text('Недостаточно данных для графика.')
+        return
+    await update.message.reply_photo(chart, caption=printer_text(
+        context.application, printer_api,
+        f'Последние {HISTORY_CHART_MINUTES} минут'))
+
+
 async def unknown_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     logger.warning(
-        f'Unknown command chat={update.effective_chat.id} '
-        f'text={update.message.text}')
+        'Unknown command chat=%s text=%s',
+        update.effective_chat.id, update.message.text)
     await update.message.reply_text(
         'Неизвестная команда', reply_markup=main_menu())
 
 
 async def forbidden(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    logger.warning(f'Access forbidden for chat={update.effective_chat.id}')
+    logger.warning('Access forbidden for chat=%s', update.effective_chat.id)
     await update.message.reply_text('Доступ запрещен')
 
 
+async def event_rules(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    printer_api = selected_printer(context)
+    events: EventEngine = context.bot_data['events'][printer_api.name]
+    store: MonitorStore = context.bot_data['monitor_store']
+    chat_id = update.effective_chat.id
+    if context.args == ['clear']:
+        logger.info('Clear event rules chat=%s printer=%s',
+                    chat_id, printer_api.name)
+        events.clear(chat_id)
+        store.clear_event_rules(chat_id, printer_api.name)
+        await update.message.reply_text('Уведомления удалены.')
+        return
+    if len(context.args) == 2:
+        try:
+            rule = create_rule(*context.args)
+        except ValueError:
+            await update.message.reply_text(EVENT_RULES_USAGE)
+            return
+        logger.info('Add event rule %s %s chat=%s printer=%s',
+                    rule.kind, rule.value, chat_id, printer_api.name)
+        if events.add(chat_id, rule):
+            store.add_event_rule(
+                chat_id, printer_api.name, rule.kind, rule.value)
+        await update.message.reply_text(printer_text(
+            context.application, printer_api,
+            f'Уведомлю: {rule.describe()}.'))
+        return
+    if context.args:
+        await update.message.reply_text(EVENT_RULES_USAGE)
+        return
+    rules = events.rules.get(chat_id, [])
+    await update.message.reply_text(
+        'Уведомления:\n' + '\n'.join(rule.describe() for rule in rules)
+        if rules else 'Уведомлений нет.\n\n' + EVENT_RULES_USAGE)
+
+
+async def toggle_photo_feed(
+        update: Update, context: ContextTypes.DEFAULT_TYPE):
+    printer_api = selected_printer(context)
+    photo_feed: PhotoFeed = context.bot_data['photo_feed'][printer_api.name]
+    chat_id = update.effective_chat.id
+    if photo_feed.remove(chat_id):
+        logger.info('Photo feed disabled chat=%s printer=%s',
+                    chat_id, printer_api.name)
+        context.bot_data['monitor_store'].set_photo_feed(
+            chat_id, printer_api.name, None)
+        await update.message.reply_text('Фотоленту выключил.')
+        return
+    if printer_api.name not in context.chat_data.get(PRINT_MONITORS_KEY, {}):
+        await update.message.reply_text(
+            'Фотолента работает только в режиме печати.')
+        return
+    logger.info('Photo feed enabled chat=%s printer=%s',
+                chat_id, printer_api.name)
+    if not await photo_feed.add(chat_id):
+        await update.message.reply_text('Ошибка при получении фото')
+        return
+    context.bot_data['monitor_store'].set_photo_feed(
+        chat_id, printer_api.name, photo_feed.chats[chat_id]['message_id'])
+
+
 async def post_init(application: Application):
     logger.info('Bot initialization')
-    application.bot_data['printer_api'] = PrinterAPI()
+    application.bot_data['metrics_server'] = await start_server()
+    printers = PrinterRegistry.from_env()
+    application.bot_data['printers'] = printers
+    application.bot_data['history'] = {}
+    application.bot_data['live_status'] = {}
+    application.bot_data[TIMELAPSE_KEY] = {}
+    application.bot_data['events'] = {}
+    application.bot_data['photo_feed'] = {}
+    for printer_api in printers:
+        printer_api.add_print_state_listener(
+            partial(broadcast_print_state, application, printer_api))
+        events = EventEngine(
+            printer_api,
+            partial(notify_event_rule, application, printer_api),
+            partial(broadcast_printer_event, application, printer_api))
+        printer_api.add_event_listener(events.handle)
+        application.bot_data['events'][printer_api.name] = events
+        history = HistorySampler(printer_api)
+        history.start()
+        application.bot_data['history'][printer_api.name] = history
+        application.bot_data['live_status'][printer_api.name] = LiveStatus(
+            application.bot, printer_api,
+            printer_api.name if printers.multiple else None)
+        application.bot_data['photo_feed'][printer_api.name] = PhotoFeed(
+            application.bot, printer_api,
+            printer_api.name if printers.multiple else None)
+    printers.start()
+    store = MonitorStore()
+    store.open()
+    application.bot_data['monitor_store'] = store
+    restore_print_monitors(application)
+    restore_event_rules(application)
+    home_server = HomeServer()
+    application.bot_data['home_server'] = home_server
+    home_server.start()
 
 
 async def post_shutdown(application: Application):
     logger.info('Bot shutdown')
-    await application.bot_data['printer_api'].close()
+    for recorder in list(application.bot_data[TIMELAPSE_KEY].values()):
+        await recorder.cancel()
+    for live_status in application.bot_data['live_status'].values():
+        await live_status.close()
+    for photo_feed in application.bot_data['photo_feed'].values():
+        await photo_feed.close()
+    for history in application.bot_data['history'].values():
+        await history.close()
+    await application.bot_data['printers'].close()
+    await application.bot_data['home_server'].close()
+    application.bot_data['monitor_store'].close()
+    metrics_server = application.bot_data.get('metrics_server')
+    if metrics_server:
+        await metrics_server.cleanup()
 
 
 async def print_mode(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    existing_job = context.chat_data.get(PRINT_MONITOR_JOB_KEY)
-    if existing_job:
-        logger.info(f'Print monitor already active '
-                    f'for chat {update.effective_chat.id}')
+    printer_api = selected_printer(context)
+    if printer_api.name in context.chat_data.get(PRINT_MONITORS_KEY, {}):
+        logger.info(
+            'Print monitor already active for chat %s printer %s',
+            update.effective_chat.id, printer_api.name)
         await update.message.reply_text(
-            'Уже слежу за печатью. Остановлюсь, как только она завершится '
-            'или прервётся.',
+            printer_text(
+                context.application, printer_api,
+                'Уже слежу за печатью. Остановлюсь, как только она '
+                'завершится или прервётся.'),
             reply_markup=main_menu(),
         )
         return
 
-    logger.info(f'Enable print monitor for chat {update.effective_chat.id}')
-    job = context.job_queue.run_repeating(
-        check_print_job,
-        interval=PRINT_MONITOR_INTERVAL,
-        first=1,
-        chat_id=update.effective_chat.id,
-        name=f'print-monitor-{update.effective_chat.id}',
-    )
-    context.chat_data[PRINT_MONITOR_JOB_KEY] = job
+    start_print_monitoring(
+        context.application, update.effective_chat.id, printer_api)
     await update.message.reply_text(
-        'Включил режим печати. Проверяю состояние каждую минуту.',
+        printer_text(
+            context.application, printer_api,
+            'Включил режим печати. Проверяю состояние тем чаще, '
+            'чем ближе завершение.'),
         reply_markup=main_menu(),
     )
+    if LIVE_STATUS_ENABLED:
+        await add_live_status(
+            context.application, update.effective_chat.id, printer_api)
+
+
+async def add_live_status(application: Application, chat_id, printer_api):
+    live_status: LiveStatus = application.bot_data['live_status'][
+        printer_api.name]
+    await live_status.add(chat_id)
+    if chat_id in live_status.chats:
+        application.bot_data['monitor_store'].set_live_status(
+            chat_id, printer_api.name,
+            live_status.chats[chat_id]['message_id'])
+
+
+def start_print_monitoring(application: Application, chat_id, printer_api):
+    logger.info('Enable print monitor for chat %s printer %s',
+                chat_id, printer_api.name)
+    schedule_print_monitor(application, chat_id, printer_api.name, 1)
+    application.bot_data['monitor_store'].add(chat_id, printer_api.name)
+    if TIMELAPSE_ENABLED:
+        start_timelapse(application, printer_api, {chat_id})
+
+
+async def upload_gcode(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    printer_api = selected_printer(context)
+    document = update.message.document
+    logger.info('G-code upload %s size=%s chat=%s printer=%s',
+                document.file_name, document.file_size,
+                update.effective_chat.id, printer_api.name)
+    try:
+        file = await document.get_file(read_timeout=GCODE_GET_FILE_TIMEOUT)
+    except BadRequest as e:
+        logger.warning('Cannot download %s: %s', document.file_name, e)
+        text = f'Не удалось получить файл из Telegram: {e.message}'
+        if (not TELEGRAM_API_SERVER
+                and (document.file_size or 0) > TELEGRAM_DOWNLOAD_LIMIT):
+            text += ('\nФайлы больше 20 МБ можно загружать только через '
+                     'локальный Bot API сервер (TELEGRAM_API_SERVER).')
+        await update.message.reply_text(text)
+        return
+    message = await update.message.reply_text(printer_text(
+        context.application, printer_api,
+        f'Загружаю {document.file_name}...'))
+
+    async def show_progress(upload):
+        await message.edit_text(printer_text(
+            context.application, printer_api,
+            f'Загружаю {document.file_name}: {upload.percent}%'))
+
+    upload = GcodeUpload(file.file_path, document.file_size, show_progress)
+    try:
+        result = await printer_api.upload(document.file_name, upload.chunks())
+    except Exception as e:
+        logger.exception('G-code upload failed chat=%s',
+                         update.effective_chat.id)
+        await message.edit_text(printer_text(
+            context.application, printer_api,
+            'Ошибка при скачивании файла из Telegram.' if upload.error
+            else f'Ошибка при загрузке файла: {user_error(e)}'))
+        return
+    path = result['item']['path']
+    uploads = context.chat_data.setdefault(UPLOADED_FILES_KEY, {})
+    uploads[str(message.message_id)] = printer_api.name, path
+    while len(uploads) > UPLOADED_FILES_LIMIT:
+        uploads.pop(next(iter(uploads)))
+    await message.edit_text(
+        printer_text(
+            context.application, printer_api, f'Файл {path} загружен.'),
+        reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton(
+            'Начать печать',
+            callback_data=f'{START_PRINT_CALLBACK}{message.message_id}',
+        )]]),
+    )
+
+
+async def start_uploaded_print(
+        update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    uploads = context.chat_data.get(UPLOADED_FILES_KEY, {})
+    key = query.data.removeprefix(START_PRINT_CALLBACK)
+    if key not in uploads:
+        await query.answer('Файл больше недоступен.')
+        return
+    printer_name, path = uploads[key]
+    printer_api: PrinterAPI = context.bot_data['printers'].get(printer_name)
+    logger.info('Start print %s chat=%s printer=%s',
+                path, update.effective_chat.id, printer_api.name)
+    try:
+        await printer_api.start_print(path)
+    except Exception as e:
+        logger.exception('Failed to start print chat=%s',
+                         update.effective_chat.id)
+        await query.answer(user_error(e), show_alert=True)
+        return
+    uploads.pop(key, None)
+    await query.answer()
+    await query.edit_message_text(printer_text(
+        context.application, printer_api, f'Печать запущена: {path}'))
+    if printer_api.name in context.chat_data.get(PRINT_MONITORS_KEY, {}):
+        return
+    start_print_monitoring(
+        context.application, update.effective_chat.id, printer_api)
+    await context.bot.send_message(
+        chat_id=update.effective_chat.id,
+        text=printer_text(
+            context.application, printer_api,
+            'Включил режим печати. Проверяю состояние тем чаще, '
+            'чем ближе завершение.'),
+        reply_markup=main_menu(),
+    )
+    if LIVE_STATUS_ENABLED:
+        await add_live_status(
+            context.application, update.effective_chat.id, printer_api)
+
+
+def schedule_print_monitor(
+        application: Application, chat_id, printer_name, first,
+        last_state=None):
+    job = application.job_queue.run_repeating(
+        check_print_job,
+        interval=PRINT_MONITOR_INTERVAL,
+        first=first,
+        chat_id=chat_id,
+        name=f'print-monitor-{chat_id}-{printer_name}',
+        data=printer_name,
+    )
+    monitor = {PRINT_MONITOR_JOB_KEY: job}
+    if last_state:
+        monitor[PRINT_MONITOR_LAST_STATE_KEY] = last_state
+    application.chat_data[chat_id].setdefault(
+        PRINT_MONITORS_KEY, {})[printer_name] = monitor
+
+
+def restore_print_monitors(application: Application):
+    store: MonitorStore = application.bot_data['monitor_store']
+    printers: PrinterRegistry = application.bot_data['printers']
+    timelapse_chats = {}
+    for (chat_id, printer_name, last_state, live_status_message_id,
+         photo_feed_message_id) in store.monitors():
+        if printer_name not in printers.printers:
+            logger.warning(
+                'Dropping print monitor for unknown printer %s chat=%s',
+                printer_name, chat_id)
+            store.remove(chat_id, printer_name)
+            continue
+        logger.info('Restore print monitor chat=%s printer=%s',
+                    chat_id, printer_name)
+        schedule_print_monitor(
+            application, chat_id, printer_name,
+            random.uniform(1, PRINT_MONITOR_INTERVAL), last_state)
+        if live_status_message_id:
+            application.bot_data['live_status'][printer_name].restore(
+                chat_id, live_status_message_id)
+        if photo_feed_message_id:
+            application.bot_data['photo_feed'][printer_name].restore(
+                chat_id, photo_feed_message_id)
+        timelapse_chats.setdefault(printer_name, set()).add(chat_id)
+    if TIMELAPSE_ENABLED:
+        for printer_name, chat_ids in timelapse_chats.items():
+            start_timelapse(
+                application, printers.get(printer_name), chat_ids,
+                resume=True)
+
+
+def restore_event_rules(application: Application):
+    store: MonitorStore = application.bot_data['monitor_store']
+    events = application.bot_data['events']
+    for chat_id, printer_name, kind, value in store.event_rules():
+        try:
+            events[printer_name].add(chat_id, create_rule(kind, value))
+        except (KeyError, ValueError):
+            logger.warning('Dropping event rule %s %s chat=%s printer=%s',
+                           kind, value, chat_id, printer_name)
+            store.remove_event_rule(chat_id, printer_name, kind, value)
 
 
 async def check_print_job(context: ContextTypes.DEFAULT_TYPE):
     job = context.job
-    printer_api: PrinterAPI = context.bot_data['printer_api']
+    PRINT_MONITOR_LAG_SECONDS.observe((
+        datetime.now(timezone.utc) - job.next_t + job.job.trigger.interval
+    ).total_seconds())
+    printer_api: PrinterAPI = context.bot_data['printers'].get(job.data)
+    monitor = context.chat_data.get(PRINT_MONITORS_KEY, {}).get(job.data)
+    if monitor is None:
+        job.schedule_removal()
+        return
     try:
         state, message = await printer_api.current_print_state()
     except Exception:
+        failures = monitor.get(PRINT_MONITOR_FAILURES_KEY, 0) + 1
+        monitor[PRINT_MONITOR_FAILURES_KEY] = failures
         logger.exception(
-            f'Printer state check failed for chat {job.chat_id}')
-        await context.bot.send_message(
-            chat_id=job.chat_id,
-            text='Нет соединения с принтером. Останавливаю проверки.',
-        )
-        stop_print_monitoring(context.chat_data, job)
+            'Printer %s state check failed for chat %s attempt=%s',
+            printer_api.name, job.chat_id, failures)
+        if failures >= PRINT_MONITOR_MAX_FAILURES:
+            await context.bot.send_message(
+                chat_id=job.chat_id,
+                text=printer_text(
+                    context.application, printer_api,
+                    'Нет соединения с принтером. Останавливаю проверки.'),
+            )
+            await stop_print_monitoring(
+                context.application, job.chat_id, context.chat_data,
+                printer_api)
+            return
+        if failures == 1:
+            await context.bot.send_message(
+                chat_id=job.chat_id,
+                text=printer_text(
+                    context.application, printer_api,
+                    'Нет соединения с принтером. Повторяю попытки.'),
+            )
+        reschedule_print_monitor(job, min(
+            PRINT_MONITOR_INTERVAL * 2 ** failures,
+            PRINT_MONITOR_MAX_INTERVAL))
         return
 
-    last_state = context.chat_data.get(PRINT_MONITOR_LAST_STATE_KEY)
+    monitor.pop(PRINT_MONITOR_FAILURES_KEY, None)
+    remaining = None
+    if state == 'printing':
+        try:
+            remaining = await printer_api.remaining_time()
+        except Exception as e:
+            logger.warning('Remaining time unavailable: %r', e)
+    await process_print_state(
+        context.application, job.chat_id, context.chat_data, printer_api,
+        state, message)
+    if printer_api.name in context.chat_data.get(PRINT_MONITORS_KEY, {}):
+        reschedule_print_monitor(job, next_print_monitor_interval(
+            monitor, state, remaining))
+
+
+def next_print_monitor_interval(monitor, state, remaining):
+    if monitor.get(PRINT_MONITOR_PHASE_KEY) != state:
+        monitor[PRINT_MONITOR_PHASE_KEY] = state
+        monitor[PRINT_MONITOR_FAST_CHECKS_KEY] = PRINT_MONITOR_FAST_CHECKS
+    fast_checks = monitor.get(PRINT_MONITOR_FAST_CHECKS_KEY, 0)
+    if fast_checks:
+        monitor[PRINT_MONITOR_FAST_CHECKS_KEY] = fast_checks - 1
+        return PRINT_MONITOR_MIN_INTERVAL
+    if remaining is None:
+        return PRINT_MONITOR_INTERVAL
+    return max(PRINT_MONITOR_MIN_INTERVAL, min(
+        round(remaining / PRINT_MONITOR_ETA_DIVISOR),
+        PRINT_MONITOR_MAX_INTERVAL))
+
+
+def reschedule_print_monitor(job, interval):
+    if job.job.trigger.interval.total_seconds() != interval:
+        logger.debug(
+            'Print monitor interval %ss chat=%s', interval, job.chat_id)
+        job.job.reschedule(trigger='interval', seconds=interval)
+
+
+async def broadcast_print_state(
+        application: Application, printer_api, state, message):
+    for chat_id, chat_data in list(application.chat_data.items()):
+        if printer_api.name in chat_data.get(PRINT_MONITORS_KEY, {}):
+            await process_print_state(
+                application, chat_id, chat_data, printer_api, state, message)
+
+
+async def notify_event_rule(
+        application: Application, printer_api, chat_id, rule, message):
+    if rule.one_shot:
+        application.bot_data['monitor_store'].remove_event_rule(
+            chat_id, printer_api.name, rule.kind, rule.value)
+    await application.bot.send_message(
+        chat_id=chat_id, text=printer_text(application, printer_api, message))
+
+
+async def broadcast_printer_event(
+        application: Application, printer_api, message):
+    logger.warning('Printer %s event: %s', printer_api.name, message)
+    chat_ids = set(application.bot_data['events'][printer_api.name].rules)
+    for chat_id, chat_data in application.chat_data.items():
+        if printer_api.name in chat_data.get(PRINT_MONITORS_KEY, {}):
+            chat_ids.add(chat_id)
+    for chat_id in chat_ids:
+        await application.bot.send_message(
+            chat_id=chat_id,
+            text=printer_text(application, printer_api, message))
+
+
+async def process_print_state(
+        application: Application, chat_id, chat_data, printer_api,
+        state, message):
+    monitor = chat_data.get(PRINT_MONITORS_KEY, {}).get(printer_api.name)
+    if monitor is None:
+        return
+    last_state = monitor.get(PRINT_MONITOR_LAST_STATE_KEY)
     if state == 'printing':
         if last_state:
-            context.chat_data.pop(PRINT_MONITOR_LAST_STATE_KEY, None)
-        logger.debug(f'Print continues normally; chat={job.chat_id}')
+            monitor.pop(PRINT_MONITOR_LAST_STATE_KEY, None)
+            application.bot_data['monitor_store'].set_last_state(
+                chat_id, printer_api.name, None)
+        logger.debug('Print continues normally; chat=%s', chat_id)
         return
 
     if state == 'paused':
         if last_state != 'paused':
-            await context.bot.send_message(
-                chat_id=job.chat_id,
-                text=message or 'Печать на паузе.',
+            monitor[PRINT_MONITOR_LAST_STATE_KEY] = 'paused'
+            application.bot_data['monitor_store'].set_last_state(
+                chat_id, printer_api.name, 'paused')
+            await application.bot.send_message(
+                chat_id=chat_id,
+                text=printer_text(
+                    application, printer_api, message or 'Печать на паузе.'),
             )
-            context.chat_data[PRINT_MONITOR_LAST_STATE_KEY] = 'paused'
         return
 
     logger.info(
-        f'Print state changed: chat={job.chat_id} state={state} '
-        f'message={message}')
-    await context.bot.send_message(
-        chat_id=job.chat_id,
-        text=message or 'Печать остановлена. Останавливаю проверки.',
+        'Print state changed: chat=%s printer=%s state=%s message=%s',
+        chat_id, printer_api.name, state, message)
+    await stop_print_monitoring(application, chat_id, chat_data, printer_api)
+    await application.bot.send_message(
+        chat_id=chat_id,
+        text=printer_text(
+            application, printer_api,
+            message or 'Печать остановлена. Останавливаю проверки.'),
     )
-    stop_print_monitoring(context.chat_data, job)
 
 
-def stop_print_monitoring(chat_data, job):
-    if job:
-        job.schedule_removal()
-    chat_data.pop(PRINT_MONITOR_JOB_KEY, None)
-    chat_data.pop(PRINT_MONITOR_LAST_STATE_KEY, None)
+def start_timelapse(
+        application: Application, printer_api, chat_ids, resume=False):
+    recorders = application.bot_data[TIMELAPSE_KEY]
+    recorder = recorders.get(printer_api.name)
+    if recorder is None:
+        logger.info('Start timelapse recording printer=%s', printer_api.name)
+        recorder = TimelapseRecorder(
+            printer_api, partial(send_timelapse, application))
+        recorders[printer_api.name] = recorder
+        recorder.start(resume)
+    recorder.chat_ids.update(chat_ids)
+
+
+async def send_timelapse(application: Application, recorder, path):
+    application.bot_data[TIMELAPSE_KEY].pop(recorder.printer_api.name, None)
+    if path is None:
+        return
+    caption = printer_text(
+        application, recorder.printer_api, 'Таймлапс печати')
+    animation = None
+    for chat_id in recorder.chat_ids:
+        logger.info('Sending timelapse chat=%s', chat_id)
+        if animation is None:
+            with open(path, 'rb') as file:
+                message = await application.bot.send_animation(
+                    chat_id=chat_id, animation=file, caption=caption,
+                    write_timeout=TIMELAPSE_UPLOAD_TIMEOUT)
+            animation = message.animation or message.document
+        else:
+            await application.bot.send_animation(
+                chat_id=chat_id, animation=animation.file_id,
+                caption=caption)
+
+
+async def stop_print_monitoring(
+        application: Application, chat_id, chat_data, printer_api):
+    monitor = chat_data.get(PRINT_MONITORS_KEY, {}).pop(
+        printer_api.name, None)
+    if monitor and monitor.get(PRINT_MONITOR_JOB_KEY):
+        monitor[PRINT_MONITOR_JOB_KEY].schedule_removal()
+    application.bot_data['monitor_store'].remove(chat_id, printer_api.name)
+    application.bot_data['photo_feed'][printer_api.name].remove(chat_id)
+    await application.bot_data['live_status'][printer_api.name].remove(
+        chat_id)
 
 
 async def poweroff(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    logger.info(f'Power-off requested by chat={update.effective_chat.id}')
+    logger.info('Power-off requested by chat=%s', update.effective_chat.id)
     await update.message.reply_text('Для продолжения нажмите /poweroff')
 
 
 async def poweroff_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    logger.info(f'Powering off printer chat={update.effective_chat.id}')
-    printer_api: PrinterAPI = context.bot_data['printer_api']
+    logger.info('Powering off printer chat=%s', update.effective_chat.id)
+    printer_api: PrinterAPI = context.bot_data['printers'].default
     try:
-        async with printer_api.session.get(
-                printer_api.printer_url + '/printer/info') as response:
-            await response.read()
+        await printer_api.ping()
     except Exception:
         logger.exception(
-            f'Connectivity check failed before power-off '
-            f'chat={update.effective_chat.id}')
+            'Connectivity check failed before power-off chat=%s',
+            update.effective_chat.id)
         await update.message.reply_text(
             'Нет соединения с принтером. Не выключаю.')
         return
-    host = os.getenv('HOME_SERVER_HOSTNAME')
-    user = os.getenv('HOME_SERVER_USER')
-    password = os.getenv('HOME_SERVER_PASSWORD')
-    if not host or not user or not password:
+    home_server: HomeServer = context.bot_data['home_server']
+    if not home_server.configured:
         logger.error('Missing SSH credentials for power-off')
         await update.message.reply_text(
             'Не настроены параметры выключения.')
         return
     try:
-        async with asyncssh.connect(
-                host,
-                username=user,
-                password=password,
-                known_hosts=None) as connection:
-            command_1 = 'cd ~/printer_power && .venv/bin/python printer.py'
-            command_2 = 'cd ~/printer_power && .venv/bin/python tapo.py'
-            result = await connection.run(command_1, check=True)
-            logger.info(
-                'Power-off command executed '
-                f'command="{command_1}" exit_status={result.exit_status}')
-            await asyncio.sleep(POWEROFF_COMMAND_DELAY_SECONDS)
-            result = await connection.run(command_2, check=True)
-            logger.info(
-                'Power-off command executed '
-                f'command="{command_2}" exit_status={result.exit_status}')
+        command_1 = 'cd ~/printer_power && .venv/bin/python printer.py'
+        command_2 = 'cd ~/printer_power && .venv/bin/python tapo.py'
+        result = await home_server.run(command_1)
+        logger.info(
+            'Power-off command executed command="%s" exit_status=%s',
+            command_1, result.exit_status)
+        await asyncio.sleep(POWEROFF_COMMAND_DELAY_SECONDS)
+        result = await home_server.run(command_2)
+        logger.info(
+            'Power-off command executed command="%s" exit_status=%s',
+            command_2, result.exit_status)
         await update.message.reply_text('Принтер выключен.')
     except Exception:
-        logger.exception(
-            f'Power-off failed chat={update.effective_chat.id}')
+        logger.exception('Power-off failed chat=%s', update.effective_chat.id)
         await update.message.reply_text('Ошибка при выключении.')
 
 
 async def poweron(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    logger.info(f'Power-on requested by chat={update.effective_chat.id}')
-    printer_api: PrinterAPI = context.bot_data['printer_api']
+    logger.info('Power-on requested by chat=%s', update.effective_chat.id)
+    printer_api: PrinterAPI = context.bot_data['printers'].default
     try:
-        async with printer_api.session.get(
-                printer_api.printer_url + '/printer/info') as response:
-            await response.read()
+        await printer_api.ping()
         logger.info('Printer is on. Skipping power-on.')
         await update.message.reply_text('Принтер включен.')
         return
     except Exception:
         pass
-    host = os.getenv('HOME_SERVER_HOSTNAME')
-    user = os.getenv('HOME_SERVER_USER')
-    password = os.getenv('HOME_SERVER_PASSWORD')
-    if not host or not user or not password:
+    home_server: HomeServer = context.bot_data['home_server']
+    if not home_server.configured:
         logger.error('Missing SSH credentials for power-on')
         await update.message.reply_text(
             'Не настроены параметры включения.')
         return
     try:
-        async with asyncssh.connect(
-                host,
-                username=user,
-                password=password,
-                known_hosts=None) as connection:
-            command = 'cd ~/printer_power && .venv/bin/python tapo.py'
-            result = await connection.run(command, check=True)
-            logger.info(
-                'Power-on command executed '
-                f'command="{command}" exit_status={result.exit_status}')
+        command = 'cd ~/printer_power && .venv/bin/python tapo.py'
+        result = await home_server.run(command)
+        logger.info(
+            'Power-on command executed command="%s" exit_status=%s',
+            command, result.exit_status)
         await update.message.reply_text('Принтер включен.')
     except Exception:
-        logger.exception(
-            f'Power-on failed chat={update.effective_chat.id}')
+        logger.exception('Power-on failed chat=%s', update.effective_chat.id)
         await update.message.reply_text('Ошибка при включении.')
 
 
@@ -283,12 +803,23 @@ if __name__ == '__main__':
     logging.basicConfig(
         level=logging.INFO,
         format='%(asctime)s %(levelname)s [%(name)s] %(message)s')
-    app = ApplicationBuilder().token(os.getenv(
-        'TELEGRAM_BOT_TOKEN', 'token')).post_init(post_init).post_shutdown(
-            post_shutdown).build()
+    builder = ApplicationBuilder().token(os.getenv(
+        'TELEGRAM_BOT_TOKEN', 'token')).request(InstrumentedRequest(
+            connection_pool_size=256)).post_init(post_init).post_shutdown(
+                post_shutdown)
+    if TELEGRAM_API_SERVER:
+        builder.base_url(f'{TELEGRAM_API_SERVER}/bot').base_file_url(
+            f'{TELEGRAM_API_SERVER}/file/bot').local_mode(TELEGRAM_LOCAL_MODE)
+    if WEBHOOK_URL:
+        builder.updater(None)
+    app = builder.build()
     filter_chat_ids(app)
     app.add_handler(CommandHandler('start', start))
     app.add_handler(CommandHandler('poweroff', poweroff_command))
+    app.add_handler(CommandHandler('printer', select_printer))
+    app.add_handler(CommandHandler('farm', farm_status))
+    app.add_handler(CommandHandler('notify', event_rules))
+    app.add_handler(CommandHandler('feed', toggle_photo_feed))
     app.add_handler(MessageHandler(
         Regex('^Состояние принтера$'), printer_info))
     app.add_handler(MessageHandler(
@@ -300,7 +831,17 @@ if __name__ == '__main__':
     app.add_handler(MessageHandler(
         Regex('^Режим печати$'), print_mode))
     app.add_handler(MessageHandler(Regex('^Фото$'), photo))
+    app.add_handler(MessageHandler(Regex('^Сводка$'), dashboard))
+    app.add_handler(MessageHandler(Regex('^Графики$'), history_chart))
     app.add_handler(MessageHandler(Regex('^Включить$'), poweron))
     app.add_handler(MessageHandler(Regex('^Выключить$'), poweroff))
+    app.add_handler(MessageHandler(
+        Document.FileExtension('gcode'), upload_gcode, block=False))
+    app.add_handler(CallbackQueryHandler(
+        start_uploaded_print, pattern=f'^{START_PRINT_CALLBACK}',
+        block=False))
     app.add_handler(MessageHandler(Text(), unknown_command))
-    app.run_polling()
+    if WEBHOOK_URL:
+        asyncio.run(run_webhook(app))
+    else:
+        app.run_polling()
@@ -0,0 +1,184 @@
+import logging
+import re
+
+from printer import FILAMENT_SENSOR
+
+
+RUNOUT_PATTERN = re.compile(r'runout', re.IGNORECASE)
+logger = logging.getLogger(__name__)
+
+
+class LayerRule:
+    kind = 'layer'
+    fields = (('print_stats', 'info'),)
+    one_shot = True
+
+    def __init__(self, value):
+        self.value = int(value)
+        if self.value < 1:
+            raise ValueError(value)
+        self._previous = None
+
+    def describe(self):
+        return f'слой {self.value}'
+
+    def check(self, status, delta):
+        layer = status.get('print_stats', {}).get(
+            'info', {}).get('current_layer')
+        if layer is None:
+            return None
+        previous, self._previous = self._previous, layer
+        if previous is not None and previous < self.value <= layer:
+            return f'Печать дошла до слоя {layer}.'
+        return None
+
+
+class ProgressRule:
+    kind = 'progress'
+    fields = (('virtual_sdcard', 'progress'),)
+    one_shot = True
+
+    def __init__(self, value):
+        self.value = float(value)
+        if not 0 < self.value <= 100:
+            raise ValueError(value)
+        self._previous = None
+
+    def describe(self):
+        return f'прогресс {self.value:g}%'
+
+    def check(self, status, delta):
+        progress = status.get('virtual_sdcard', {}).get('progress')
+        if progress is None:
+            return None
+        progress *= 100
+        previous, self._previous = self._previous, progress
+        if previous is not None and previous < self.value <= progress:
+            return f'Прогресс печати достиг {self.value:g}%.'
+        return None
+
+
+class TemperatureRule:
+    kind = 'temp'
+    heater = 'extruder'
+    fields = (('extruder', 'temperature'), ('extruder', 'target'))
+    one_shot = False
+
+    def __init__(self, value):
+        self.value = float(value)
+        if self.value <= 0:
+            raise ValueError(value)
+        self._stable = False
+        self._alerting = False
+
+    def describe(self):
+        return f'отклонение экструдера больше {self.value:g}°C'
+
+    def check(self, status, delta):
+        heater = status.get(self.heater, {})
+        temperature = heater.get('temperature')
+        target = heater.get('target')
+        if 'target' in delta.get(self.heater, {}) or not target:
+            self._stable = False
+            self._alerting = False
+        if temperature is None or not target:
+            return None
+        deviation = temperature - target
+        if abs(deviation) <= self.value:
+            self._stable = True
+            self._alerting = False
+            return None
+        if not self._stable or self._alerting:
+            return None
+        self._alerting = True
+        return (f'Температура экструдера {temperature:.1f}°C отклонилась '
+                f'от заданной {target:.1f}°C на {deviation:+.1f}°C.')
+
+
+RULE_TYPES = {rule.kind: rule for rule in (
+    LayerRule, ProgressRule, TemperatureRule)}
+
+
+def create_rule(kind, value):
+    if kind not in RULE_TYPES:
+        raise ValueError(kind)
+    return RULE_TYPES[kind](value)
+
+
+class EventEngine:
+    def __init__(self, printer_api, notify, alert):
+        self.printer_api = printer_api
+        self.notify = notify
+        self.alert = alert
+        self.rules = {}
+        self._index = {}
+        self._filament_detected = None
+
+    def add(self, chat_id, rule):
+        rules = self.rules.setdefault(chat_id, [])
+        if any(existing.kind == rule.kind and existing.value == rule.value
+               for existing in rules):
+            return False
+        rule.check(self.printer_api.status, self.printer_api.status)
+        rules.append(rule)
+        self._reindex()
+        return True
+
+    def clear(self, chat_id):
+        self.rules.pop(chat_id, None)
+        self._reindex()
+
+    def _remove(self, chat_id, rule):
+        rules = self.rules.get(chat_id, [])
+        if rule in rules:
+            rules.remove(rule)
+        if not rules:
+            self.rules.pop(chat_id, None)
+        self._reindex()
+
+    def _reindex(self):
+        self._index = {}
+        for chat_id, rules in self.rules.items():
+            for rule in rules:
+                for name, field in rule.fields:
+                    self._index.setdefault((name, field), []).append(
+                        (chat_id, rule))
+
+    async def handle(self, method, params):
+        if method == 'notify_status_update':
+            await self._handle_status(params)
+        elif method == 'notify_gcode_response':
+            for line in params:
+                if line.startswith('!! '):
+                    await self.alert(f'Ошибка принтера: {line[3:]}')
+                elif RUNOUT_PATTERN.search(line):
+                    await self.alert(f'Закончился филамент: {line}')
+        elif method == 'notify_klippy_shutdown':
+            webhooks = self.printer_api.status.get('webhooks', {})
+            await self.alert('Аварийная остановка Klippy: ' + webhooks.get(
+                'state_message', 'причина неизвестна'))
+
+    async def _handle_status(self, delta):
+        if FILAMENT_SENSOR in delta:
+            detected = delta[FILAMENT_SENSOR].get('filament_detected')
+            if detected is not None:
+                previous, self._filament_detected = (
+                    self._filament_detected, detected)
+                if previous and not detected:
+                    await self.alert('Датчик филамента: филамент закончился.')
+        triggered = []
+        for name, values in delta.items():
+            for field in values:
+                for chat_id, rule in self._index.get((name, field), ()):
+                    if (chat_id, rule) not in triggered:
+                        triggered.append((chat_id, rule))
+        status = self.printer_api.status
+        for chat_id, rule in triggered:
+            message = rule.check(status, delta)
+            if message is None:
+                continue
+            logger.info('Event rule %s %s fired chat=%s',
+                        rule.kind, rule.value, chat_id)
+            if rule.one_shot:
+                self._remove(chat_id, rule)
+            await self.notify(chat_id, rule, message)
@@ -0,0 +1,69 @@
+import asyncio
+import logging
+import time
+from urllib.parse import urlsplit
+
+from aiohttp import ClientSession, ClientTimeout
+
+
+UPLOAD_CHUNK_SIZE = 256 * 1024
+UPLOAD_PROGRESS_INTERVAL = 3
+DOWNLOAD_TIMEOUT = ClientTimeout(total=None, sock_connect=10, sock_read=60)
+logger = logging.getLogger(__name__)
+
+
+class GcodeUpload:
+    def __init__(self, file_path, size, on_progress):
+        self.file_path = file_path
+        self.size = size
+        self.on_progress = on_progress
+        self.received = 0
+        self.error = None
+        self._next_progress = time.monotonic() + UPLOAD_PROGRESS_INTERVAL
+
+    async def chunks(self):
+        if urlsplit(self.file_path).scheme in ('http', 'https'):
+            source = self._download()
+        else:
+            source = self._read_local_file()
+        try:
+            async for chunk in source:
+                self.received += len(chunk)
+                await self._report_progress()
+                yield chunk
+        except Exception as e:
+            logger.warning('Telegram file download failed: %r', e)
+            self.error = e
+            raise
+
+    async def _download(self):
+        async with ClientSession(
+                timeout=DOWNLOAD_TIMEOUT, raise_for_status=True) as session:
+            async with session.get(self.file_path) as response:
+                async for chunk in response.content.iter_chunked(
+                        UPLOAD_CHUNK_SIZE):
+                    yield chunk
+
+    async def _read_local_file(self):
+        file = await asyncio.to_thread(open, self.file_path, 'rb')
+        try:
+            while chunk := await asyncio.to_thread(
+                    file.read, UPLOAD_CHUNK_SIZE):
+                yield chunk
+        finally:
+            file.close()
+
+    @property
+    def percent(self):
+        if not self.size:
+            return 0
+        return min(100, self.received * 100 // self.size)
+
+    async def _report_progress(self):
+        if time.monotonic() < self._next_progress:
+            return
+        self._next_progress = time.monotonic() + UPLOAD_PROGRESS_INTERVAL
+        try:
+            await self.on_progress(self)
+        except Exception as e:
+            logger.warning('Upload progress update failed: %r', e)
@@ -0,0 +1,174 @@
+import asyncio
+import logging
+import math
+import os
+import time
+from array import array
+from io import BytesIO
+
+
+HISTORY_INTERVAL = float(os.getenv('HISTORY_INTERVAL', '10'))
+HISTORY_HOST_INTERVAL = float(os.getenv('HISTORY_HOST_INTERVAL', '60'))
+HISTORY_SIZE = int(os.getenv('HISTORY_SIZE', '720'))
+HISTORY_CHART_MINUTES = int(os.getenv('HISTORY_CHART_MINUTES', '60'))
+HISTORY_MAX_BACKOFF = 300
+HISTORY_FIELDS = (
+    'extruder', 'heater_bed', 'heater_bed_outer',
+    'cpu_usage', 'cpu_temp', 'ram_usage', 'throttled',
+)
+CHART_WIDTH = 800
+CHART_PANEL_HEIGHT = 260
+CHART_MARGIN = 50
+CHART_PANELS = (
+    ('Temperature, °C', (
+        ('extruder', 'Extruder', (220, 50, 47)),
+        ('heater_bed', 'Bed', (38, 139, 210)),
+        ('heater_bed_outer', 'Outer bed', (133, 153, 0)),
+    )),
+    ('Host', (
+        ('cpu_usage', 'CPU %', (211, 54, 130)),
+        ('ram_usage', 'RAM %', (108, 113, 196)),
+        ('cpu_temp', 'CPU °C', (203, 75, 22)),
+    )),
+)
+logger = logging.getLogger(__name__)
+
+
+class RingBuffer:
+    def __init__(self, capacity, fields):
+        self.capacity = capacity
+        self.fields = fields
+        self.timestamps = array('d', bytes(8 * capacity))
+        self.columns = {
+            field: array('f', bytes(4 * capacity)) for field in fields}
+        self.size = 0
+        self._next = 0
+
+    def append(self, timestamp, values):
+        index = self._next
+        self.timestamps[index] = timestamp
+        for field, column in self.columns.items():
+            column[index] = values.get(field, math.nan)
+        self._next = (index + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def since(self, start):
+        first = (self._next - self.size) % self.capacity
+        indexes = [
+            index for index in (
+                (first + offset) % self.capacity
+                for offset in range(self.size))
+            if self.timestamps[index] >= start]
+        return (
+            [self.timestamps[index] for index in indexes],
+            {field: [column[index] for index in indexes]
+             for field, column in self.columns.items()},
+        )
+
+
+class HistorySampler:
+    def __init__(self, printer_api):
+        self.printer_api = printer_api
+        self.buffer = RingBuffer(HISTORY_SIZE, HISTORY_FIELDS)
+        self._next_host_sample = 0
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _run(self):
+        delay = HISTORY_INTERVAL
+        while True:
+            try:
+                await self.sample()
+                delay = HISTORY_INTERVAL
+            except Exception as e:
+                logger.debug('History sample failed: %r', e)
+                delay = min(delay * 2, HISTORY_MAX_BACKOFF)
+            await asyncio.sleep(delay)
+
+    async def sample(self):
+        if self.printer_api.subscribed:
+            heaters = self.printer_api.status
+        else:
+            heaters = await self.printer_api.heaters()
+        values = {}
+        if time.monotonic() >= self._next_host_sample:
+            stats = await self.printer_api.machine_stats()
+            self._next_host_sample = time.monotonic() + HISTORY_HOST_INTERVAL
+            values.update({
+                'cpu_usage': stats['system_cpu_usage']['cpu'],
+                'cpu_temp': stats['cpu_temp'],
+                'ram_usage': (stats['system_memory']['used'] * 100
+                              / stats['system_memory']['total']),
+                'throttled': float(
+                    stats['throttled_state'].get('bits', 0) != 0),
+            })
+        for field, name in (
+            ('extruder', 'extruder'),
+            ('heater_bed', 'heater_bed'),
+            ('heater_bed_outer', 'heater_generic heater_bed_outer'),
+        ):
+            temperature = heaters.get(name, {}).get('temperature')
+            if temperature is not None:
+                values[field] = temperature
+        self.buffer.append(time.time(), values)
+
+    async def chart(self, minutes=HISTORY_CHART_MINUTES):
+        timestamps, columns = self.buffer.since(time.time() - minutes * 60)
+        if len(timestamps) < 2:
+            return None
+        return await asyncio.to_thread(
+            render_chart, timestamps, columns, minutes)
+
+
+def render_chart(timestamps, columns, minutes):
+    from PIL import Image, ImageDraw, ImageFont
+
+    font = ImageFont.load_default(12)
+    height = CHART_PANEL_HEIGHT * len(CHART_PANELS)
+    image = Image.new('RGB', (CHART_WIDTH, height), 'white')
+    draw = ImageDraw.Draw(image)
+    end = timestamps[-1]
+    start = end - minutes * 60
+    for number, (title, series) in enumerate(CHART_PANELS):
+        top = number * CHART_PANEL_HEIGHT + 25
+        bottom = (number + 1) * CHART_PANEL_HEIGHT - 25
+        left, right = CHART_MARGIN, CHART_WIDTH - 15
+        values = [value for field, _, _ in series
+                  for value in columns[field] if not math.isnan(value)]
+        if not values:
+            continue
+        low, high = min(values), max(values)
+        if high - low < 1:
+            low, high = low - 1, high + 1
+        draw.rectangle((left, top, right, bottom), outline=(180, 180, 180))
+        draw.text((left, top - 18), title, fill='black', font=font)
+        draw.text((5, top), f'{high:.0f}', fill='black', font=font)
+        draw.text((5, bottom - 12), f'{low:.0f}', fill='black', font=font)
+        draw.text((left, bottom + 4), f'-{minutes} min',
+                  fill='black', font=font)
+        draw.text((right - 30, bottom + 4), 'now', fill='black', font=font)
+        legend_x = left + 150
+        for field, label, color in series:
+            points = [
+                (left + (right - left) * (timestamp - start) / (end - start),
+                 bottom - (bottom - top) * (value - low) / (high - low))
+                for timestamp, value in zip(timestamps, columns[field])
+                if not math.isnan(value)]
+            if len(points) > 1:
+                draw.line(points, fill=color, width=2)
+            draw.text((legend_x, top - 18), label, fill=color, font=font)
+            legend_x += 100
+    output = BytesIO()
+    image.save(output, format='PNG', optimize=True)
+    return output.getvalue()
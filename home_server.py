@@ -0,0 +1,98 @@
+import asyncio
+import importlib
+import logging
+import os
+
+
+SSH_CONNECT_TIMEOUT = 10
+SSH_KEEPALIVE_INTERVAL = 30
+SSH_KEEPALIVE_COUNT_MAX = 3
+SSH_CONNECT_ATTEMPTS = 3
+SSH_RECONNECT_MIN_DELAY = 1
+SSH_RECONNECT_MAX_DELAY = 30
+logger = logging.getLogger(__name__)
+
+
+class HomeServer:
+    def __init__(self, host=None, username=None, password=None, port=22,
+                 known_hosts=None):
+        self.host = host or os.getenv('HOME_SERVER_HOSTNAME')
+        self.username = username or os.getenv('HOME_SERVER_USER')
+        self.password = password or os.getenv('HOME_SERVER_PASSWORD')
+        self.port = port
+        self.known_hosts = known_hosts
+        self.connection = None
+        self._lock = asyncio.Lock()
+        self._reconnect_delay = SSH_RECONNECT_MIN_DELAY
+        self._warm_up_task = None
+
+    @property
+    def configured(self):
+        return bool(self.host and self.username and self.password)
+
+    async def run(self, command):
+        import asyncssh
+
+        connection = await self.connect()
+        try:
+            return await connection.run(command, check=True)
+        except asyncssh.ChannelOpenError:
+            logger.warning('SSH channel open failed, reconnecting')
+            self._drop(connection)
+            connection = await self.connect()
+            return await connection.run(command, check=True)
+
+    async def connect(self):
+        import asyncssh
+
+        async with self._lock:
+            if self.connection and not self.connection.is_closed():
+                return self.connection
+            self.connection = None
+            for attempt in range(1, SSH_CONNECT_ATTEMPTS + 1):
+                try:
+                    self.connection = await asyncssh.connect(
+                        self.host,
+                        port=self.port,
+                        username=self.username,
+                        password=self.password,
+                        known_hosts=self.known_hosts,
+                        connect_timeout=SSH_CONNECT_TIMEOUT,
+                        keepalive_interval=SSH_KEEPALIVE_INTERVAL,
+                        keepalive_count_max=SSH_KEEPALIVE_COUNT_MAX,
+                    )
+                    logger.info('SSH connected to %s', self.host)
+                    self._reconnect_delay = SSH_RECONNECT_MIN_DELAY
+                    return self.connection
+                except (OSError, asyncssh.Error) as e:
+                    logger.warning(
+                        'SSH connection attempt %s failed: %r', attempt, e)
+                    if attempt == SSH_CONNECT_ATTEMPTS:
+                        raise
+                    await asyncio.sleep(self._reconnect_delay)
+                    self._reconnect_delay = min(
+                        self._reconnect_delay * 2, SSH_RECONNECT_MAX_DELAY)
+
+    def start(self):
+        if self.configured and self._warm_up_task is None:
+            self._warm_up_task = asyncio.create_task(self._warm_up())
+
+    async def _warm_up(self):
+        try:
+            await asyncio.to_thread(importlib.import_module, 'asyncssh')
+            await self.connect()
+        except Exception as e:
+            logger.warning('SSH warm-up failed: %r', e)
+
+    def _drop(self, connection):
+        connection.close()
+        if self.connection is connection:
+            self.connection = None
+
+    async def close(self):
+        if self._warm_up_task:
+            self._warm_up_task.cancel()
+        if self.connection:
+            self.connection.close()
+            await self.connection.wait_closed()
+            self.connection = None
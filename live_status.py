@@ -0,0 +1,116 @@
+import asyncio
+import logging
+import os
+import time
+from datetime import timedelta
+
+from telegram.error import BadRequest, RetryAfter, TelegramError
+
+
+LIVE_STATUS_INTERVAL = float(os.getenv('LIVE_STATUS_INTERVAL', '30'))
+LIVE_STATUS_MIN_EDIT_INTERVAL = 10
+LIVE_STATUS_EDITS_PER_SECOND = 20
+logger = logging.getLogger(__name__)
+
+
+class LiveStatus:
+    def __init__(self, bot, printer_api, title=None):
+        self.bot = bot
+        self.printer_api = printer_api
+        self.title = title
+        self.chats = {}
+        self._task = None
+
+    async def add(self, chat_id):
+        if chat_id in self.chats:
+            return
+        text = await self._render() or 'Нет данных о печати.'
+        message = await self.bot.send_message(chat_id=chat_id, text=text)
+        try:
+            await self.bot.pin_chat_message(
+                chat_id=chat_id, message_id=message.message_id,
+                disable_notification=True)
+        except BadRequest as e:
+            logger.warning('Cannot pin live status chat=%s: %s', chat_id, e)
+        self.chats[chat_id] = {
+            'message_id': message.message_id,
+            'text': text,
+            'next_edit': time.monotonic() + LIVE_STATUS_MIN_EDIT_INTERVAL,
+        }
+        self._ensure_running()
+
+    def restore(self, chat_id, message_id):
+        self.chats[chat_id] = {
+            'message_id': message_id,
+            'text': None,
+            'next_edit': time.monotonic(),
+        }
+        self._ensure_running()
+
+    def _ensure_running(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def remove(self, chat_id):
+        chat = self.chats.pop(chat_id, None)
+        if chat is None:
+            return
+        try:
+            await self.bot.unpin_chat_message(
+                chat_id=chat_id, message_id=chat['message_id'])
+        except BadRequest as e:
+            logger.warning('Cannot unpin live status chat=%s: %s', chat_id, e)
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _render(self):
+        try:
+            text = await self.printer_api.live_status()
+            return f'{self.title}\n{text}' if self.title else text
+        except Exception as e:
+            logger.warning('Live status render failed: %r', e)
+            return None
+
+    async def _run(self):
+        while self.chats:
+            await asyncio.sleep(LIVE_STATUS_INTERVAL)
+            text = await self._render()
+            if text is None:
+                continue
+            for chat_id in list(self.chats):
+                chat = self.chats.get(chat_id)
+                if (chat is None or chat['text'] == text
+                        or chat['next_edit'] > time.monotonic()):
+                    continue
+                await self._edit(chat_id, chat, text)
+                await asyncio.sleep(1 / LIVE_STATUS_EDITS_PER_SECOND)
+
+    async def _edit(self, chat_id, chat, text):
+        try:
+            await self.bot.edit_message_text(
+                text, chat_id=chat_id, message_id=chat['message_id'])
+        except RetryAfter as e:
+            delay = e.retry_after
+            if isinstance(delay, timedelta):
+                delay = delay.total_seconds()
+            logger.warning(
+                'Live status throttled chat=%s retry_after=%s', chat_id, delay)
+            chat['next_edit'] = time.monotonic() + delay
+            return
+        except BadRequest as e:
+            if 'not modified' not in str(e):
+                logger.warning(
+                    'Live status edit failed chat=%s: %s', chat_id, e)
+                self.chats.pop(chat_id, None)
+                return
+        except TelegramError as e:
+            logger.warning('Live status edit failed chat=%s: %s', chat_id, e)
+            return
+        chat['text'] = text
+        chat['next_edit'] = time.monotonic() + LIVE_STATUS_MIN_EDIT_INTERVAL
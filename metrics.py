@@ -0,0 +1,136 @@
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+from aiohttp import web
+from telegram.request import HTTPXRequest
+
+
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+logger = logging.getLogger(__name__)
+registry = []
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.values = {}
+        registry.append(self)
+
+    def inc(self, value=1, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        self.values[key] = self.values.get(key, 0) + value
+
+    def samples(self):
+        for key, value in self.values.items():
+            yield self.name, self._labels(key), value
+
+    def _labels(self, key, **extra):
+        pairs = list(zip(self.labelnames, key)) + list(extra.items())
+        return ','.join(
+            f'{name}="{_escape(value)}"' for name, value in pairs)
+
+
+class Histogram(Counter):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(),
+                 buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = buckets
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        counts = self.values.setdefault(key, [0] * (len(self.buckets) + 2))
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[index] += 1
+        counts[-2] += 1
+        counts[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        for key, counts in self.values.items():
+            for bound, count in zip(self.buckets, counts):
+                yield (f'{self.name}_bucket',
+                       self._labels(key, le=bound), count)
+            yield (f'{self.name}_bucket',
+                   self._labels(key, le='+Inf'), counts[-2])
+            yield f'{self.name}_count', self._labels(key), counts[-2]
+            yield f'{self.name}_sum', self._labels(key), counts[-1]
+
+
+class InstrumentedRequest(HTTPXRequest):
+    async def do_request(self, url, method, *args, **kwargs):
+        with TELEGRAM_REQUEST_SECONDS.time(method=url.rsplit('/', 1)[-1]):
+            return await super().do_request(url, method, *args, **kwargs)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"')
+
+
+def render():
+    lines = []
+    for metric in registry:
+        lines.append(f'# HELP {metric.name} {metric.documentation}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        for name, labels, value in metric.samples():
+            lines.append(f'{name}{{{labels}}} {value}' if labels
+                         else f'{name} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+async def handle_metrics(request):
+    return web.Response(text=render(), content_type='text/plain')
+
+
+async def start_server():
+    if not METRICS_PORT:
+        return None
+    app = web.Application()
+    app.router.add_get('/metrics', handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, METRICS_HOST, METRICS_PORT).start()
+    logger.info('Metrics available on http://%s:%s/metrics',
+                METRICS_HOST, METRICS_PORT)
+    return runner
+
+
+PRINTER_REQUEST_SECONDS = Histogram(
+    'printer_request_seconds',
+    'Latency of requests to Moonraker.', ('endpoint',))
+PRINTER_REQUEST_ERRORS = Counter(
+    'printer_request_errors_total',
+    'Failed requests to Moonraker by status.', ('endpoint', 'status'))
+PRINTER_REQUEST_RETRIES = Counter(
+    'printer_request_retries_total',
+    'Retried requests to Moonraker.', ('endpoint',))
+PRINTER_CACHE_LOOKUPS = Counter(
+    'printer_cache_lookups_total',
+    'PrinterAPI cache lookups by result.', ('key', 'result'))
+PHOTO_PROCESSING_SECONDS = Histogram(
+    'photo_processing_seconds',
+    'Time spent rotating and encoding camera snapshots.')
+TELEGRAM_REQUEST_SECONDS = Histogram(
+    'telegram_request_seconds',
+    'Latency of Telegram Bot API calls.', ('method',))
+PRINT_MONITOR_LAG_SECONDS = Histogram(
+    'print_monitor_lag_seconds',
+    'Delay between the scheduled and actual start of print checks.')
@@ -0,0 +1,133 @@
+import asyncio
+import logging
+import os
+import time
+from datetime import timedelta
+from io import BytesIO
+
+from telegram import InputMediaPhoto
+from telegram.error import BadRequest, RetryAfter, TelegramError
+
+
+PHOTO_FEED_INTERVAL = float(os.getenv('PHOTO_FEED_INTERVAL', '60'))
+PHOTO_FEED_THRESHOLD = float(os.getenv('PHOTO_FEED_THRESHOLD', '2'))
+PIXEL_DELTA = 16
+PHOTO_FEED_EDITS_PER_SECOND = 20
+THUMBNAIL_SIZE = (32, 18)
+logger = logging.getLogger(__name__)
+
+
+class PhotoFeed:
+    def __init__(self, bot, printer_api, title=None):
+        self.bot = bot
+        self.printer_api = printer_api
+        self.title = title
+        self.chats = {}
+        self._task = None
+
+    async def add(self, chat_id):
+        if chat_id in self.chats:
+            return True
+        try:
+            image_bytes = await self.printer_api.snapshot()
+            thumbnail = await asyncio.to_thread(downscale, image_bytes)
+        except Exception as e:
+            logger.warning('Photo feed snapshot failed: %r', e)
+            return False
+        message = await self.bot.send_photo(
+            chat_id=chat_id, photo=image_bytes, caption=self._caption())
+        self.chats[chat_id] = {
+            'message_id': message.message_id,
+            'thumbnail': thumbnail,
+            'next_edit': time.monotonic(),
+        }
+        self._ensure_running()
+        return True
+
+    def restore(self, chat_id, message_id):
+        self.chats[chat_id] = {
+            'message_id': message_id,
+            'thumbnail': None,
+            'next_edit': time.monotonic(),
+        }
+        self._ensure_running()
+
+    def _ensure_running(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def remove(self, chat_id):
+        return self.chats.pop(chat_id, None) is not None
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def _caption(self):
+        caption = time.strftime('Снимок %H:%M:%S')
+        return f'{self.title}\n{caption}' if self.title else caption
+
+    async def _run(self):
+        while self.chats:
+            await asyncio.sleep(PHOTO_FEED_INTERVAL)
+            try:
+                image_bytes = await self.printer_api.snapshot()
+                thumbnail = await asyncio.to_thread(downscale, image_bytes)
+            except Exception as e:
+                logger.warning('Photo feed snapshot failed: %r', e)
+                continue
+            for chat_id in list(self.chats):
+                chat = self.chats.get(chat_id)
+                if chat is None or chat['next_edit'] > time.monotonic():
+                    continue
+                difference = (
+                    frame_difference(chat['thumbnail'], thumbnail)
+                    if chat['thumbnail'] is not None else 100)
+                if difference < PHOTO_FEED_THRESHOLD:
+                    logger.debug('Photo feed frame unchanged chat=%s '
+                                 'changed=%.1f%%', chat_id, difference)
+                    continue
+                await self._edit(chat_id, chat, image_bytes, thumbnail)
+                await asyncio.sleep(1 / PHOTO_FEED_EDITS_PER_SECOND)
+
+    async def _edit(self, chat_id, chat, image_bytes, thumbnail):
+        try:
+            await self.bot.edit_message_media(
+                InputMediaPhoto(image_bytes, caption=self._caption()),
+                chat_id=chat_id, message_id=chat['message_id'])
+        except RetryAfter as e:
+            delay = e.retry_after
+            if isinstance(delay, timedelta):
+                delay = delay.total_seconds()
+            logger.warning(
+                'Photo feed throttled chat=%s retry_after=%s', chat_id, delay)
+            chat['next_edit'] = time.monotonic() + delay
+            return
+        except BadRequest as e:
+            logger.warning('Photo feed edit failed chat=%s: %s', chat_id, e)
+            self.chats.pop(chat_id, None)
+            return
+        except TelegramError as e:
+            logger.warning('Photo feed edit failed chat=%s: %s', chat_id, e)
+            return
+        chat['thumbnail'] = thumbnail
+        chat['next_edit'] = time.monotonic()
+
+
+def downscale(image_bytes):
+    from PIL import Image
+
+    with Image.open(BytesIO(image_bytes)) as image:
+        image.draft('L', (THUMBNAIL_SIZE[0] * 8, THUMBNAIL_SIZE[1] * 8))
+        return image.convert('L').resize(
+            THUMBNAIL_SIZE, Image.Resampling.BOX).tobytes()
+
+
+def frame_difference(previous, current):
+    changed = sum(
+        abs(a - b) > PIXEL_DELTA for a, b in zip(previous, current))
+    return changed * 100 / len(current)
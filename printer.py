@@ -1,17 +1,64 @@
+import asyncio
+import json
 import logging
 import os
+import random
+import time
+from collections import OrderedDict
 from datetime import timedelta
+from functools import partial
 from io import BytesIO
+from urllib.parse import quote
 
-from aiohttp import ClientSession
-from PIL import Image
+from aiohttp import (ClientConnectionError, ClientError, ClientPayloadError,
+                     ClientSession, ClientTimeout, MultipartWriter,
+                     TCPConnector, WSMsgType)
 
+from metrics import (PHOTO_PROCESSING_SECONDS, PRINTER_CACHE_LOOKUPS,
+                     PRINTER_REQUEST_ERRORS, PRINTER_REQUEST_RETRIES,
+                     PRINTER_REQUEST_SECONDS)
 
+
+PRINT_STATUS_OBJECTS = ('webhooks', 'virtual_sdcard', 'print_stats')
+ACTIVE_PRINT_STATES = ('printing', 'paused')
+HEATER_OBJECTS = ('extruder', 'heater_bed', 'heater_generic heater_bed_outer')
+FILAMENT_SENSOR = os.getenv('FILAMENT_SENSOR', '')
+EVENT_METHODS = ('notify_gcode_response', 'notify_klippy_shutdown')
+METADATA_CACHE_SIZE = 32
+PRINTER_CACHE_TTL = float(os.getenv('PRINTER_CACHE_TTL', '2'))
+PHOTO_CACHE_TTL = float(os.getenv('PHOTO_CACHE_TTL', '3'))
+PRINTER_CONNECT_TIMEOUT = float(os.getenv('PRINTER_CONNECT_TIMEOUT', '5'))
+PRINTER_JSON_TIMEOUT = float(os.getenv('PRINTER_JSON_TIMEOUT', '10'))
+PRINTER_SNAPSHOT_TIMEOUT = float(os.getenv('PRINTER_SNAPSHOT_TIMEOUT', '20'))
+PRINTER_CONNECTION_LIMIT = int(os.getenv('PRINTER_CONNECTION_LIMIT', '8'))
+PRINTER_KEEPALIVE_TIMEOUT = float(
+    os.getenv('PRINTER_KEEPALIVE_TIMEOUT', '60'))
+PRINTER_DNS_CACHE_TTL = int(os.getenv('PRINTER_DNS_CACHE_TTL', '300'))
+PRINTER_UPLOAD_TIMEOUT = float(os.getenv('PRINTER_UPLOAD_TIMEOUT', '300'))
+PRINTER_RETRIES = int(os.getenv('PRINTER_RETRIES', '2'))
+PRINTER_RETRY_DELAY = float(os.getenv('PRINTER_RETRY_DELAY', '0.5'))
+RETRYABLE_STATUSES = (502, 503, 504)
+JSON_TIMEOUT = ClientTimeout(
+    total=PRINTER_JSON_TIMEOUT, connect=PRINTER_CONNECT_TIMEOUT)
+SNAPSHOT_TIMEOUT = ClientTimeout(
+    total=PRINTER_SNAPSHOT_TIMEOUT, connect=PRINTER_CONNECT_TIMEOUT)
+UPLOAD_TIMEOUT = ClientTimeout(
+    total=None, connect=PRINTER_CONNECT_TIMEOUT,
+    sock_read=PRINTER_UPLOAD_TIMEOUT)
+WEBSOCKET_HEARTBEAT_SECONDS = 30
+WEBSOCKET_RECONNECT_MIN_DELAY = 5
+WEBSOCKET_RECONNECT_MAX_DELAY = 120
 logger = logging.getLogger(__name__)
 
 
+class PrinterError(RuntimeError):
+    def __init__(self, message, retryable=False):
+        super().__init__(message)
+        self.retryable = retryable
+
+
 class PrinterAPI:
-    def __init__(self):
+    def __init__(self, printer_url=None, name='printer'):
         self.session = ClientSession(
             headers={
                 'CF-Access-Client-Id': os.getenv('CLOUDFLARE_AC_ID', 'id'),
@@ -19,8 +66,28 @@ class PrinterAPI:
                     'CLOUDFLARE_AC_SECRET', 'secret'),
             },
             raise_for_status=self.response_error,
+            timeout=ClientTimeout(
+                total=None, connect=PRINTER_CONNECT_TIMEOUT),
+            connector=TCPConnector(
+                limit=PRINTER_CONNECTION_LIMIT,
+                keepalive_timeout=PRINTER_KEEPALIVE_TIMEOUT,
+                ttl_dns_cache=PRINTER_DNS_CACHE_TTL,
+            ),
         )
-        self.printer_url = os.getenv('PRINTER_URL', 'printer_url')
+        self.name = name
+        self.printer_url = printer_url or os.getenv(
+            'PRINTER_URL', 'printer_url')
+        self.status = {}
+        self.subscribed = False
+        self.print_state_listeners = []
+        self.event_listeners = []
+        self._last_print_state = None
+        self._websocket_task = None
+        self._dispatch_task = None
+        self._dispatch_queue = asyncio.Queue()
+        self._cache = {}
+        self._pending = {}
+        self._metadata = OrderedDict()
         self.klippy_states = {
             'ready': 'Klippy инициализирован и готов к командам.',
             'startup': 'Klippy находится в процессе запуска.',
@@ -35,103 +102,140 @@ class PrinterAPI:
 
     async def photo(self):
         try:
-            logger.debug('Requesting camera snapshot')
-            async with self.session.get(
-                    self.printer_url + '/webcam/?action=snapshot') as response:
-                image_bytes = await response.read()
-            with Image.open(BytesIO(image_bytes)) as image:
-                rotated_image = image.rotate(180)
-                output = BytesIO()
-                rotated_image.save(output, format=image.format or 'JPEG')
-                return output.getvalue()
+            return await self.snapshot()
         except Exception as e:
             logger.exception('Failed to fetch photo')
-            return str(e)
+            return user_error(e)
+
+    async def snapshot(self):
+        return await self._cached(
+            ('photo',), self._fetch_photo, PHOTO_CACHE_TTL)
+
+    async def _fetch_photo(self):
+        logger.debug('Requesting camera snapshot')
+        image_bytes = await self._get('/webcam/?action=snapshot', raw=True)
+        with PHOTO_PROCESSING_SECONDS.time():
+            return await asyncio.to_thread(rotate_image, image_bytes)
 
     async def printer_info(self):
         try:
-            async with self.session.get(
-                    self.printer_url + '/printer/info') as response:
-                data = await response.json()
-                state = data['result']['state']
-                logger.info(f'Klippy state: {state}')
-                return self.klippy_states[state]
+            result = await self._query('/printer/info')
+            state = result['state']
+            logger.info('Klippy state: %s', state)
+            return self.klippy_states[state]
         except Exception as e:
             logger.exception('Failed to fetch printer info')
-            return str(e)
+            return user_error(e)
 
     async def proc_stats(self):
         try:
-            async with self.session.get(
-                    self.printer_url + '/machine/proc_stats') as response:
-                data = await response.json()
-                result = data['result']
-                cpu_usage = result['system_cpu_usage']['cpu']
-                cpu_temp = result['cpu_temp']
-                throttled_state = result['throttled_state']
-                ram_usage = (result['system_memory']['used'] * 100
-                             / result['system_memory']['total'])
-                logger.debug(
-                    f'proc stats cpu={cpu_usage:.2f} '
-                    f'temp={cpu_temp:.2f} throttled={throttled_state} '
-                    f'ram={ram_usage:.2f}')
-                return (
-                    f'Загрузка процессора: {round(cpu_usage)}%\n' +
-                    f'Температура процессора: {round(cpu_temp)}°C\n' +
-                    f'Троттлинг: {"да" if throttled_state else "нет"}\n' +
-                    f'Загрузка ОЗУ: {round(ram_usage)}%\n'
-                )
+            return self._format_machine_stats(await self.machine_stats())
         except Exception as e:
             logger.exception('Failed to fetch system stats')
-            return str(e)
+            return user_error(e)
+
+    def _format_machine_stats(self, result):
+        cpu_usage = result['system_cpu_usage']['cpu']
+        cpu_temp = result['cpu_temp']
+        throttled_state = result['throttled_state']
+        throttled = throttled_state.get('bits', 0) != 0
+        ram_usage = (result['system_memory']['used'] * 100
+                     / result['system_memory']['total'])
+        logger.debug(
+            'proc stats cpu=%.2f temp=%.2f throttled=%s ram=%.2f',
+            cpu_usage, cpu_temp, throttled_state, ram_usage)
+        return (
+            f'Загрузка процессора: {round(cpu_usage)}%\n' +
+            f'Температура процессора: {round(cpu_temp)}°C\n' +
+            f'Троттлинг: {"да" if throttled else "нет"}\n' +
+            f'Загрузка ОЗУ: {round(ram_usage)}%\n'
+        )
+
+    async def machine_stats(self):
+        return await self._query('/machine/proc_stats')
+
+    async def heaters(self):
+        result = await self._query(
+            '/printer/objects/query',
+            [(name, 'temperature,target,power') for name in HEATER_OBJECTS])
+        return result['status']
 
     async def _get_print_status(self):
-        async with self.session.get(
-                self.printer_url + '/printer/objects/query?'
-                + 'webhooks&virtual_sdcard&print_stats') as response:
-            data = await response.json()
-        return data['result']['status']
+        if self.subscribed:
+            return self.status
+        result = await self._query(
+            '/printer/objects/query?' + '&'.join(PRINT_STATUS_OBJECTS))
+        self._expire_metadata(result['status'])
+        return result['status']
+
+    async def _estimated_time(self, filename):
+        if filename in self._metadata:
+            self._metadata.move_to_end(filename)
+            return self._metadata[filename]
+        result = await self._query(
+            '/server/files/metadata', {'filename': filename})
+        self._metadata[filename] = result['estimated_time']
+        if len(self._metadata) > METADATA_CACHE_SIZE:
+            self._metadata.popitem(last=False)
+        return result['estimated_time']
+
+    def _expire_metadata(self, status):
+        print_stats = status.get('print_stats', {})
+        if print_stats.get('state') not in ACTIVE_PRINT_STATES:
+            self._metadata.pop(print_stats.get('filename'), None)
 
     async def print_status(self):
         try:
-            status = await self._get_print_status()
-            logger.debug(f'Raw print status data: {status}')
-            if status['webhooks']['state'] != 'ready':
-                return 'Принтер не готов: ' + status['webhooks']['message']
-            if status['print_stats']['state'] == 'standby':
-                return 'Принтер в ожидании'
-            if status['print_stats']['state'] == 'error':
-                return 'Ошибка: ' + status['print_stats']['message']
-            filename = status['print_stats']['filename']
-            if status['print_stats']['state'] == 'complete':
-                return 'Печать завершена: ' + filename
-            async with self.session.get(
-                    self.printer_url + '/server/files/metadata',
-                    params={'filename': filename}
-                    ) as file_response:
-                file_data = await file_response.json()
-                estimated_time = file_data['result']['estimated_time']
-            prog_time = (status['virtual_sdcard']['progress'] * estimated_time)
-            eta = str(timedelta(
-                seconds=(estimated_time - prog_time))).split('.')[0]
-            print_states = {
-                'printing': 'Печатается',
-                'paused': 'Пауза',
-            }
-            return (
-                f'{print_states[status["print_stats"]["state"]]}: '
-                f'{filename}\n'
-                f'Прогресс: {round(
-                    status["virtual_sdcard"]["progress"] * 100)}%\n'
-                f'Оставшееся время: {eta}'
-            )
+            return await self._format_print_status(
+                await self._get_print_status())
         except Exception as e:
             logger.exception('Failed to fetch print status')
-            return str(e)
+            return user_error(e)
+
+    async def _format_print_status(self, status):
+        logger.debug('Raw print status data: %s', status)
+        if status['webhooks']['state'] != 'ready':
+            return 'Принтер не готов: ' + status['webhooks']['message']
+        if status['print_stats']['state'] == 'standby':
+            return 'Принтер в ожидании'
+        if status['print_stats']['state'] == 'error':
+            return 'Ошибка: ' + status['print_stats']['message']
+        filename = status['print_stats']['filename']
+        if status['print_stats']['state'] == 'complete':
+            return 'Печать завершена: ' + filename
+        estimated_time = await self._estimated_time(filename)
+        prog_time = (status['virtual_sdcard']['progress'] * estimated_time)
+        eta = str(timedelta(
+            seconds=(estimated_time - prog_time))).split('.')[0]
+        print_states = {
+            'printing': 'Печатается',
+            'paused': 'Пауза',
+        }
+        return (
+            f'{print_states[status["print_stats"]["state"]]}: '
+            f'{filename}\n'
+            f'Прогресс: {round(
+                status["virtual_sdcard"]["progress"] * 100)}%\n'
+            f'Оставшееся время: {eta}'
+        )
 
     async def current_print_state(self):
+        return self._print_state(await self._get_print_status())
+
+    async def remaining_time(self):
         status = await self._get_print_status()
-        logger.debug(f'Current print state: {status}')
+        print_stats = status['print_stats']
+        if print_stats['state'] not in ACTIVE_PRINT_STATES:
+            return None
+        estimated_time = await self._estimated_time(print_stats['filename'])
+        return estimated_time * (1 - status['virtual_sdcard']['progress'])
+
+    async def current_layer(self):
+        status = await self._get_print_status()
+        return status['print_stats'].get('info', {}).get('current_layer')
+
+    def _print_state(self, status):
+        logger.debug('Current print state: %s', status)
         if status['webhooks']['state'] != 'ready':
             message = status['webhooks'].get('message', 'Принтер не готов')
             return 'not_ready', 'Принтер не готов: ' + message
@@ -157,55 +261,335 @@ class PrinterAPI:
 
     async def temperatures(self):
         try:
-            params = [
-                ('extruder', 'temperature,target,power'),
-                ('heater_bed', 'temperature,target,power'),
-                ('heater_generic heater_bed_outer',
-                 'temperature,target,power'),
-            ]
-            async with self.session.get(
-                    self.printer_url + '/printer/objects/query',
-                    params=params) as response:
-                data = await response.json()
-            status = data['result']['status']
-            parts = []
-            for title, key in (
-                ('Экструдер', 'extruder'),
-                ('Стол', 'heater_bed'),
-                ('Внешний стол', 'heater_generic heater_bed_outer'),
-            ):
-                values = status.get(key)
-                if not values:
-                    continue
-                temperature = values.get('temperature')
-                target = values.get('target')
-                power = values.get('power')
-                power_pct = (round(power * 100)
-                             if power is not None else None)
-                temp_text = (f'{temperature:.1f}°C'
-                             if temperature is not None else '—')
-                target_text = (f'{target:.1f}°C'
-                               if target is not None else '—')
-                power_text = (f'{power_pct}%'
-                              if power_pct is not None else '—')
-                parts.append(
-                    f'{title}: {temp_text} / {target_text}, '
-                    f'мощность {power_text}'
-                )
-            return '\n'.join(parts) or 'Нет данных о температуре.'
+            return self._format_temperatures(await self.heaters())
         except Exception as e:
             logger.exception('Failed to fetch temperatures')
-            return str(e)
+            return user_error(e)
+
+    def _format_temperatures(self, status):
+        parts = []
+        for title, key in (
+            ('Экструдер', 'extruder'),
+            ('Стол', 'heater_bed'),
+            ('Внешний стол', 'heater_generic heater_bed_outer'),
+        ):
+            values = status.get(key)
+            if not values:
+                continue
+            temperature = values.get('temperature')
+            target = values.get('target')
+            power = values.get('power')
+            power_pct = (round(power * 100)
+                         if power is not None else None)
+            temp_text = (f'{temperature:.1f}°C'
+                         if temperature is not None else '—')
+            target_text = (f'{target:.1f}°C'
+                           if target is not None else '—')
+            power_text = (f'{power_pct}%'
+                          if power_pct is not None else '—')
+            parts.append(
+                f'{title}: {temp_text} / {target_text}, '
+                f'мощность {power_text}'
+            )
+        return '\n'.join(parts) or 'Нет данных о температуре.'
+
+    async def live_status(self):
+        status, heaters = await asyncio.gather(
+            self._get_print_status(), self.heaters())
+        return (await self._format_print_status(status) + '\n\n'
+                + self._format_temperatures(heaters))
+
+    async def dashboard(self):
+        status, stats = await asyncio.gather(
+            self._query(
+                '/printer/objects/query?' + '&'.join(
+                    PRINT_STATUS_OBJECTS + tuple(
+                        f'{quote(name)}=temperature,target,power'
+                        for name in HEATER_OBJECTS))),
+            self.machine_stats(),
+            return_exceptions=True,
+        )
+        if isinstance(status, Exception):
+            logger.warning('Dashboard status query failed: %r', status)
+            return user_error(status)
+        status = status['status']
+        self._expire_metadata(status)
+        parts = [self.klippy_states.get(
+            status['webhooks']['state'], status['webhooks']['state'])]
+        try:
+            parts.append(await self._format_print_status(status))
+        except Exception as e:
+            logger.exception('Failed to format print status')
+            parts.append(user_error(e))
+        parts.append(self._format_temperatures(status))
+        if isinstance(stats, Exception):
+            logger.warning('Dashboard proc stats failed: %r', stats)
+            parts.append(user_error(stats))
+        else:
+            parts.append(self._format_machine_stats(stats).rstrip())
+        return '\n\n'.join(parts)
+
+    async def _query(self, path, params=None):
+        if isinstance(params, dict):
+            params = sorted(params.items())
+        return await self._cached(
+            (path, tuple(params or ())),
+            partial(self._fetch_json, path, params),
+            PRINTER_CACHE_TTL)
+
+    async def _cached(self, key, fetch, ttl):
+        name = key[0].partition('?')[0]
+        cached = self._cache.get(key)
+        if cached and cached[0] > time.monotonic():
+            PRINTER_CACHE_LOOKUPS.inc(key=name, result='hit')
+            return cached[1]
+        future = self._pending.get(key)
+        if future is None:
+            PRINTER_CACHE_LOOKUPS.inc(key=name, result='miss')
+            future = asyncio.ensure_future(fetch())
+            future.add_done_callback(partial(self._store, key, ttl))
+            self._pending[key] = future
+        else:
+            PRINTER_CACHE_LOOKUPS.inc(key=name, result='coalesced')
+        return await asyncio.shield(future)
+
+    async def _fetch_json(self, path, params):
+        data = await self._get(path, params)
+        return data['result']
+
+    async def ping(self):
+        await self._get('/printer/info')
+
+    async def upload(self, filename, chunks):
+        with MultipartWriter('form-data') as writer:
+            writer.append('gcodes').set_content_disposition(
+                'form-data', name='root')
+            writer.append(
+                chunks, {'Content-Type': 'application/octet-stream'},
+            ).set_content_disposition(
+                'form-data', name='file', filename=filename)
+            endpoint = '/server/files/upload'
+            with PRINTER_REQUEST_SECONDS.time(endpoint=endpoint):
+                data = await self._request(
+                    'POST', endpoint, data=writer, timeout=UPLOAD_TIMEOUT)
+        self._metadata.pop(data['result']['item']['path'], None)
+        return data['result']
+
+    async def start_print(self, filename):
+        endpoint = '/printer/print/start'
+        with PRINTER_REQUEST_SECONDS.time(endpoint=endpoint):
+            await self._request('POST', endpoint, {'filename': filename})
+        self._cache.clear()
+
+    async def _get(self, path, params=None, raw=False):
+        endpoint = path.partition('?')[0]
+        for attempt in range(PRINTER_RETRIES + 1):
+            try:
+                with PRINTER_REQUEST_SECONDS.time(endpoint=endpoint):
+                    return await self._request(
+                        'GET', path, params, raw=raw,
+                        timeout=SNAPSHOT_TIMEOUT if raw else JSON_TIMEOUT)
+            except PrinterError as e:
+                if not e.retryable or attempt == PRINTER_RETRIES:
+                    raise
+                delay = PRINTER_RETRY_DELAY * 2 ** attempt * random.uniform(
+                    0.5, 1.5)
+                logger.debug('Retrying %s in %.2fs: %s', endpoint, delay, e)
+            PRINTER_REQUEST_RETRIES.inc(endpoint=endpoint)
+            await asyncio.sleep(delay)
+
+    async def _request(self, method, path, params=None, data=None,
+                       raw=False, timeout=JSON_TIMEOUT):
+        endpoint = path.partition('?')[0]
+        try:
+            async with self.session.request(
+                    method, self.printer_url + path, params=params,
+                    data=data, timeout=timeout) as response:
+                if raw:
+                    return await response.read()
+                return await response.json()
+        except PrinterError:
+            raise
+        except asyncio.TimeoutError as e:
+            PRINTER_REQUEST_ERRORS.inc(endpoint=endpoint, status='timeout')
+            raise PrinterError(
+                'Принтер не ответил вовремя.', retryable=True) from e
+        except (ClientConnectionError, ClientPayloadError) as e:
+            PRINTER_REQUEST_ERRORS.inc(
+                endpoint=endpoint, status=type(e).__name__)
+            raise PrinterError(
+                'Нет соединения с принтером.', retryable=True) from e
+        except ClientError as e:
+            PRINTER_REQUEST_ERRORS.inc(
+                endpoint=endpoint, status=type(e).__name__)
+            raise PrinterError('Некорректный ответ принтера.') from e
+
+    def _store(self, key, ttl, future):
+        self._pending.pop(key, None)
+        if future.cancelled() or future.exception() is not None:
+            return
+        now = time.monotonic()
+        for expired in [k for k, (expires, _) in self._cache.items()
+                        if expires <= now]:
+            del self._cache[expired]
+        self._cache[key] = (now + ttl, future.result())
 
     async def response_error(self, response):
+        if not response.ok:
+            PRINTER_REQUEST_ERRORS.inc(
+                endpoint=response.url.path, status=response.status)
         if response.status == 530:
-            raise RuntimeError(
+            raise PrinterError(
                 'Статус 530: Принтер выключен или находится не в сети.')
         if not response.ok:
             logger.warning(
-                f'HTTP status {response.status}: {response.reason}')
-            raise RuntimeError(
-                f'Status {response.status}: {response.reason}')
+                'HTTP status %s: %s', response.status, response.reason)
+            raise PrinterError(
+                f'Status {response.status}: {response.reason}',
+                retryable=response.status in RETRYABLE_STATUSES)
+
+    def add_print_state_listener(self, listener):
+        self.print_state_listeners.append(listener)
+
+    def add_event_listener(self, listener):
+        self.event_listeners.append(listener)
+
+    def start(self):
+        if self._websocket_task is None:
+            self._websocket_task = asyncio.create_task(
+                self._websocket_loop())
+            self._dispatch_task = asyncio.create_task(self._dispatch_loop())
+
+    async def _websocket_loop(self):
+        delay = WEBSOCKET_RECONNECT_MIN_DELAY
+        while True:
+            try:
+                async with self.session.ws_connect(
+                        self.printer_url + '/websocket',
+                        heartbeat=WEBSOCKET_HEARTBEAT_SECONDS) as websocket:
+                    logger.info('Moonraker websocket connected')
+                    delay = WEBSOCKET_RECONNECT_MIN_DELAY
+                    await self._subscribe(websocket)
+                    async for message in websocket:
+                        if message.type != WSMsgType.TEXT:
+                            break
+                        await self._handle_websocket_message(
+                            websocket, json.loads(message.data))
+                logger.warning('Moonraker websocket closed')
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning('Moonraker websocket failed: %r', e)
+            self.subscribed = False
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, WEBSOCKET_RECONNECT_MAX_DELAY)
+
+    async def _subscribe(self, websocket):
+        await websocket.send_json({
+            'jsonrpc': '2.0',
+            'method': 'printer.objects.subscribe',
+            'params': {
+                'objects': subscription_objects(),
+            },
+            'id': 'subscribe',
+        })
+
+    async def _handle_websocket_message(self, websocket, data):
+        method = data.get('method')
+        if data.get('id') == 'subscribe':
+            if 'error' in data:
+                logger.warning('Subscription failed: %s', data['error'])
+                return
+            self.status = data['result']['status']
+            self.subscribed = True
+            self._expire_metadata(self.status)
+            logger.info('Subscribed to printer status updates')
+            self._emit('notify_status_update', dict(self.status))
+        elif method == 'notify_status_update':
+            delta = data['params'][0]
+            for name, values in delta.items():
+                self.status.setdefault(name, {}).update(values)
+            self._expire_metadata(self.status)
+            if self.subscribed:
+                self._emit(method, delta)
+        elif method in EVENT_METHODS:
+            self._emit(method, data.get('params', []))
+            return
+        elif method == 'notify_filelist_changed':
+            for change in data['params']:
+                item = change.get('item', {})
+                if item.get('root') == 'gcodes':
+                    self._metadata.pop(item.get('path'), None)
+            return
+        elif method == 'notify_klippy_ready':
+            await self._subscribe(websocket)
+            return
+        elif method == 'notify_klippy_disconnected':
+            self.subscribed = False
+            return
+        else:
+            return
+        if self.subscribed:
+            self._notify_print_state()
+
+    def _emit(self, method, params):
+        if self.event_listeners:
+            self._dispatch_queue.put_nowait(
+                (self.event_listeners, (method, params)))
+
+    def _notify_print_state(self):
+        state, message = self._print_state(self.status)
+        if (state, message) == self._last_print_state:
+            return
+        self._last_print_state = state, message
+        self._dispatch_queue.put_nowait(
+            (self.print_state_listeners, (state, message)))
+
+    async def _dispatch_loop(self):
+        while True:
+            listeners, args = await self._dispatch_queue.get()
+            for listener in listeners:
+                try:
+                    await listener(*args)
+                except Exception:
+                    logger.exception('Printer listener failed')
 
     async def close(self):
+        for task in (self._websocket_task, self._dispatch_task):
+            if task:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
         await self.session.close()
+
+
+def subscription_objects():
+    objects = {name: None for name in PRINT_STATUS_OBJECTS}
+    for name in HEATER_OBJECTS:
+        objects[name] = ['temperature', 'target']
+    if FILAMENT_SENSOR:
+        objects[FILAMENT_SENSOR] = ['filament_detected']
+    return objects
+
+
+def rotate_image(image_bytes):
+    from PIL import Image, JpegImagePlugin
+
+    with Image.open(BytesIO(image_bytes)) as image:
+        rotated_image = image.transpose(Image.Transpose.ROTATE_180)
+        output = BytesIO()
+        if image.format == 'JPEG':
+            rotated_image.save(
+                output, format='JPEG', qtables=image.quantization,
+                subsampling=JpegImagePlugin.get_sampling(image))
+        else:
+            rotated_image.save(output, format=image.format or 'JPEG')
+        return output.getvalue()
+
+
+def user_error(error):
+    if isinstance(error, PrinterError):
+        return str(error)
+    return 'Не удалось получить данные от принтера.'
@@ -0,0 +1,72 @@
+import asyncio
+import logging
+import os
+
+from printer import PrinterAPI, user_error
+
+
+PRINTER_FANOUT_TIMEOUT = float(os.getenv('PRINTER_FANOUT_TIMEOUT', '10'))
+logger = logging.getLogger(__name__)
+
+
+class PrinterRegistry:
+    def __init__(self, printers):
+        self.printers = {printer.name: printer for printer in printers}
+
+    @classmethod
+    def from_env(cls):
+        config = os.getenv('PRINTERS', '')
+        if not config:
+            return cls([PrinterAPI()])
+        entries = {}
+        for item in config.split(','):
+            if not item.strip():
+                continue
+            name, _, url = (part.strip() for part in item.partition('='))
+            if not name or not url:
+                raise ValueError(
+                    f'Invalid PRINTERS entry {item.strip()!r}, '
+                    'expected name=url')
+            if name in entries:
+                raise ValueError(
+                    f'Duplicate printer name {name!r} in PRINTERS')
+            entries[name] = url
+        if not entries:
+            raise ValueError('PRINTERS is set but lists no printers')
+        return cls([PrinterAPI(url, name) for name, url in entries.items()])
+
+    @property
+    def default(self):
+        return next(iter(self.printers.values()))
+
+    @property
+    def multiple(self):
+        return len(self.printers) > 1
+
+    def get(self, name):
+        return self.printers.get(name) or self.default
+
+    def __iter__(self):
+        return iter(self.printers.values())
+
+    async def fan_out(self, call):
+        async def run(printer_api):
+            try:
+                return await asyncio.wait_for(
+                    call(printer_api), PRINTER_FANOUT_TIMEOUT)
+            except asyncio.TimeoutError:
+                logger.warning('Printer %s timed out', printer_api.name)
+                return 'Принтер не ответил вовремя.'
+            except Exception as e:
+                logger.warning('Printer %s failed: %r', printer_api.name, e)
+                return user_error(e)
+
+        results = await asyncio.gather(*(run(printer) for printer in self))
+        return dict(zip(self.printers, results))
+
+    def start(self):
+        for printer_api in self:
+            printer_api.start()
+
+    async def close(self):
+        await asyncio.gather(*(printer_api.close() for printer_api in self))
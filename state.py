@@ -0,0 +1,115 @@
+import logging
+import os
+import sqlite3
+
+
+STATE_DB_PATH = os.getenv('STATE_DB_PATH', 'bot_state.sqlite3')
+MESSAGE_COLUMNS = ('live_status_message_id', 'photo_feed_message_id')
+logger = logging.getLogger(__name__)
+
+
+class MonitorStore:
+    def __init__(self, path=STATE_DB_PATH):
+        self.path = path
+        self._connection = None
+
+    def open(self):
+        if self._connection is not None or not self.path:
+            return
+        self._connection = sqlite3.connect(self.path, isolation_level=None)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS print_monitors ('
+            'chat_id INTEGER NOT NULL, '
+            'printer TEXT NOT NULL, '
+            'last_state TEXT, '
+            'live_status_message_id INTEGER, '
+            'photo_feed_message_id INTEGER, '
+            'PRIMARY KEY (chat_id, printer))')
+        columns = {row[1] for row in self._connection.execute(
+            'PRAGMA table_info(print_monitors)')}
+        for column in MESSAGE_COLUMNS:
+            if column not in columns:
+                self._connection.execute(
+                    f'ALTER TABLE print_monitors ADD COLUMN {column} INTEGER')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS event_rules ('
+            'chat_id INTEGER NOT NULL, '
+            'printer TEXT NOT NULL, '
+            'kind TEXT NOT NULL, '
+            'value REAL NOT NULL, '
+            'PRIMARY KEY (chat_id, printer, kind, value))')
+        logger.info('Monitor state stored in %s', self.path)
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def monitors(self):
+        if self._connection is None:
+            return []
+        return self._connection.execute(
+            'SELECT chat_id, printer, last_state, live_status_message_id, '
+            'photo_feed_message_id FROM print_monitors'
+        ).fetchall()
+
+    def add(self, chat_id, printer):
+        self._execute(
+            'INSERT OR IGNORE INTO print_monitors (chat_id, printer) '
+            'VALUES (?, ?)', (chat_id, printer))
+
+    def set_last_state(self, chat_id, printer, state):
+        self._execute(
+            'UPDATE print_monitors SET last_state = ? '
+            'WHERE chat_id = ? AND printer = ?', (state, chat_id, printer))
+
+    def set_live_status(self, chat_id, printer, message_id):
+        self._execute(
+            'UPDATE print_monitors SET live_status_message_id = ? '
+            'WHERE chat_id = ? AND printer = ?',
+            (message_id, chat_id, printer))
+
+    def set_photo_feed(self, chat_id, printer, message_id):
+        self._execute(
+            'UPDATE print_monitors SET photo_feed_message_id = ? '
+            'WHERE chat_id = ? AND printer = ?',
+            (message_id, chat_id, printer))
+
+    def remove(self, chat_id, printer):
+        self._execute(
+            'DELETE FROM print_monitors WHERE chat_id = ? AND printer = ?',
+            (chat_id, printer))
+
+    def event_rules(self):
+        if self._connection is None:
+            return []
+        return self._connection.execute(
+            'SELECT chat_id, printer, kind, value FROM event_rules'
+        ).fetchall()
+
+    def add_event_rule(self, chat_id, printer, kind, value):
+        self._execute(
+            'INSERT OR IGNORE INTO event_rules '
+            '(chat_id, printer, kind, value) VALUES (?, ?, ?, ?)',
+            (chat_id, printer, kind, value))
+
+    def remove_event_rule(self, chat_id, printer, kind, value):
+        self._execute(
+            'DELETE FROM event_rules '
+            'WHERE chat_id = ? AND printer = ? AND kind = ? AND value = ?',
+            (chat_id, printer, kind, value))
+
+    def clear_event_rules(self, chat_id, printer):
+        self._execute(
+            'DELETE FROM event_rules WHERE chat_id = ? AND printer = ?',
+            (chat_id, printer))
+
+    def _execute(self, query, params):
+        if self._connection is None:
+            return
+        try:
+            self._connection.execute(query, params)
+        except sqlite3.Error:
+            logger.exception('Failed to store monitor state')
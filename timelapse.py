@@ -0,0 +1,173 @@
+import asyncio
+import logging
+import os
+import re
+import shutil
+import time
+from pathlib import Path
+
+from printer import ACTIVE_PRINT_STATES
+
+
+TIMELAPSE_INTERVAL = float(os.getenv('TIMELAPSE_INTERVAL', '60'))
+TIMELAPSE_PER_LAYER = os.getenv('TIMELAPSE_PER_LAYER', '').lower() in (
+    '1', 'true')
+TIMELAPSE_POLL_SECONDS = 10
+TIMELAPSE_MAX_FRAMES = int(os.getenv('TIMELAPSE_MAX_FRAMES', '240'))
+TIMELAPSE_WIDTH = int(os.getenv('TIMELAPSE_WIDTH', '480'))
+TIMELAPSE_FRAME_DURATION_MS = 100
+TIMELAPSE_DIR = os.getenv('TIMELAPSE_DIR', 'timelapse')
+logger = logging.getLogger(__name__)
+
+
+class TimelapseRecorder:
+    def __init__(self, printer_api, on_finish):
+        self.printer_api = printer_api
+        self.on_finish = on_finish
+        self.chat_ids = set()
+        self.interval = TIMELAPSE_INTERVAL
+        self.layer_step = 1
+        self.directory = None
+        self.frames = []
+        self._frame_index = 0
+        self._last_capture = None
+        self._last_layer = None
+        self._task = None
+
+    def start(self, resume=False):
+        self.directory = Path(TIMELAPSE_DIR) / re.sub(
+            r'[^\w-]', '_', self.printer_api.name)
+        if resume:
+            self._load_frames()
+        else:
+            shutil.rmtree(self.directory, ignore_errors=True)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._task = asyncio.create_task(self._run())
+
+    def _load_frames(self):
+        self.frames = sorted(self.directory.glob('*.jpg'))
+        if not self.frames:
+            return
+        self._frame_index = int(self.frames[-1].stem) + 1
+        if len(self.frames) > 1:
+            self.interval = max(
+                self.interval,
+                self.frames[-1].stat().st_mtime
+                - self.frames[-2].stat().st_mtime)
+        logger.info(
+            'Timelapse resumed printer=%s frames=%s interval=%.0fs',
+            self.printer_api.name, len(self.frames), self.interval)
+
+    async def cancel(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _run(self):
+        state = None
+        path = None
+        try:
+            while True:
+                try:
+                    state, _ = await self.printer_api.current_print_state()
+                    if state == 'printing' and await self._capture_due():
+                        await self._capture()
+                except Exception as e:
+                    logger.warning('Timelapse state check failed: %r', e)
+                    state = None
+                if state is not None and state not in ACTIVE_PRINT_STATES:
+                    break
+                await asyncio.sleep(TIMELAPSE_POLL_SECONDS)
+            logger.info(
+                'Timelapse stopped state=%s frames=%s',
+                state, len(self.frames))
+            if state == 'complete' and self.frames:
+                path = self.directory / 'timelapse.gif'
+                started = time.monotonic()
+                await asyncio.to_thread(
+                    assemble_gif, list(self.frames), path)
+                logger.info(
+                    'Timelapse assembled in %.1fs size=%s',
+                    time.monotonic() - started, path.stat().st_size)
+        except asyncio.CancelledError:
+            logger.info(
+                'Timelapse interrupted, keeping %s frames in %s',
+                len(self.frames), self.directory)
+            raise
+        except Exception:
+            logger.exception('Timelapse recording failed')
+            path = None
+        try:
+            await self.on_finish(self, path)
+        except Exception:
+            logger.exception('Failed to deliver timelapse')
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    async def _capture_due(self):
+        if TIMELAPSE_PER_LAYER:
+            layer = await self.printer_api.current_layer()
+            if layer is None or layer == self._last_layer:
+                return False
+            if (self._last_layer is not None
+                    and layer - self._last_layer < self.layer_step):
+                return False
+            self._last_layer = layer
+            return True
+        return (self._last_capture is None
+                or time.monotonic() - self._last_capture >= self.interval)
+
+    async def _capture(self):
+        self._last_capture = time.monotonic()
+        try:
+            image_bytes = await self.printer_api.snapshot()
+        except Exception as e:
+            logger.warning('Timelapse snapshot failed: %r', e)
+            return
+        path = self.directory / f'{self._frame_index:06d}.jpg'
+        self._frame_index += 1
+        await asyncio.to_thread(path.write_bytes, image_bytes)
+        self.frames.append(path)
+        if len(self.frames) >= TIMELAPSE_MAX_FRAMES:
+            self._thin_frames()
+
+    def _thin_frames(self):
+        dropped = self.frames[1::2]
+        self.frames = self.frames[::2]
+        for path in dropped:
+            path.unlink(missing_ok=True)
+        self.interval *= 2
+        self.layer_step *= 2
+        logger.info(
+            'Timelapse thinned to %s frames, interval=%.0fs layer_step=%s',
+            len(self.frames), self.interval, self.layer_step)
+
+
+def assemble_gif(frame_paths, output_path):
+    from PIL import Image
+
+    def frames():
+        for path in frame_paths[1:]:
+            with Image.open(path) as image:
+                yield _resize(image)
+
+    with Image.open(frame_paths[0]) as image:
+        first_frame = _resize(image)
+    first_frame.save(
+        output_path,
+        format='GIF',
+        save_all=True,
+        append_images=frames(),
+        duration=TIMELAPSE_FRAME_DURATION_MS,
+        loop=0,
+    )
+
+
+def _resize(image):
+    from PIL import Image
+
+    height = round(image.height * TIMELAPSE_WIDTH / image.width)
+    return image.convert('RGB').resize(
+        (TIMELAPSE_WIDTH, height), Image.Resampling.BILINEAR)
@@ -0,0 +1,86 @@
+import asyncio
+import logging
+import os
+import secrets
+import signal
+from urllib.parse import urlsplit
+
+from aiohttp import web
+from telegram import Update
+
+
+WEBHOOK_URL = os.getenv('TELEGRAM_WEBHOOK_URL', '')
+WEBHOOK_HOST = os.getenv('TELEGRAM_WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('TELEGRAM_WEBHOOK_PORT', '8080'))
+WEBHOOK_SECRET = (os.getenv('TELEGRAM_WEBHOOK_SECRET')
+                  or secrets.token_urlsafe(32))
+WEBHOOK_PATH = urlsplit(WEBHOOK_URL).path or '/telegram'
+logger = logging.getLogger(__name__)
+
+
+def create_web_app(application):
+    async def handle_update(request):
+        if not secrets.compare_digest(
+                request.headers.get(
+                    'X-Telegram-Bot-Api-Secret-Token', '').encode(),
+                WEBHOOK_SECRET.encode()):
+            logger.warning('Webhook request with invalid secret token')
+            return web.Response(status=403)
+        try:
+            update = Update.de_json(await request.json(), application.bot)
+        except Exception:
+            logger.exception('Malformed webhook update')
+            return web.Response(status=400)
+        await application.update_queue.put(update)
+        return web.Response()
+
+    async def handle_health(request):
+        return web.json_response({'status': 'ok'})
+
+    async def handle_ready(request):
+        printers = application.bot_data.get('printers') or ()
+        return web.json_response({
+            'telegram': application.running,
+            'printer_websocket': {
+                printer_api.name: printer_api.subscribed
+                for printer_api in printers},
+        }, status=200 if application.running else 503)
+
+    app = web.Application()
+    app.router.add_post(WEBHOOK_PATH, handle_update)
+    app.router.add_get('/healthz', handle_health)
+    app.router.add_get('/readyz', handle_ready)
+    return app
+
+
+async def run_webhook(application):
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    runner = web.AppRunner(create_web_app(application))
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+        await application.bot.set_webhook(
+            WEBHOOK_URL,
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=Update.ALL_TYPES,
+        )
+        await application.start()
+        logger.info('Webhook listening on %s:%s%s',
+                    WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH)
+        await stop.wait()
+    finally:
+        await runner.cleanup()
+        if application.running:
+            await application.stop()
+            if application.post_stop:
+                await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)